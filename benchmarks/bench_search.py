@@ -0,0 +1,101 @@
+'''Benchmark the catalog search scoring on a synthetic Whoosh index
+
+Compares the former double search_page pass (total + page) against the
+single pass of search_index.search_ids.
+
+    python benchmarks/bench_search.py --docs 100000 --runs 50
+'''
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from whoosh import fields, index
+from whoosh.qparser import MultifieldParser
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_search_index():
+    spec = importlib.util.spec_from_file_location('search_index',
+        os.path.join(BASEDIR, 'search_index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_index(dirname, docs, vocabulary, seed=0):
+    schema = fields.Schema(
+        id=fields.NUMERIC(int, stored=True, unique=True),
+        title=fields.TEXT(stored=True),
+        content=fields.TEXT,
+        )
+    ix = index.create_in(dirname, schema)
+    rnd = random.Random(seed)
+    writer = ix.writer(limitmb=256)
+    for i in range(1, docs + 1):
+        writer.add_document(
+            id=i,
+            title=' '.join(rnd.sample(vocabulary, 3)),
+            content=' '.join(rnd.sample(vocabulary, 20)),
+            )
+    writer.commit()
+    return ix
+
+
+def double_pass(searcher, query, page, limit, max_limit):
+    all_results = searcher.search_page(query, 1, pagelen=max_limit)
+    total = all_results.scored_length()
+    results = searcher.search_page(query, page, pagelen=limit)
+    return [result.get('id') for result in results], total
+
+
+def timed(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'p50': timings[len(timings) // 2] * 1000,
+        'p95': timings[int(len(timings) * 0.95) - 1] * 1000,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--max-limit', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    search_index = load_search_index()
+    vocabulary = ['word%d' % i for i in range(2000)]
+    dirname = tempfile.mkdtemp(prefix='catalog-bench-')
+    try:
+        ix = build_index(dirname, args.docs, vocabulary)
+        parser = MultifieldParser(['title', 'content'], ix.schema)
+        queries = [parser.parse(w) for w in vocabulary[:10]]
+        with ix.searcher() as searcher:
+            for name, func in (
+                    ('double search_page', lambda q: double_pass(
+                        searcher, q, 2, args.limit, args.max_limit)),
+                    ('single search_ids', lambda q: search_index.search_ids(
+                        searcher, q, args.max_limit)[
+                            args.limit:2 * args.limit]),
+                    ):
+                result = timed(lambda: [func(q) for q in queries], args.runs)
+                sys.stdout.write('%-20s p50 %8.2f ms  p95 %8.2f ms\n' % (
+                        name, result['p50'], result['p95']))
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    main()
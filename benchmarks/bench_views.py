@@ -0,0 +1,782 @@
+'''Benchmark the catalog views against a stand-in Tryton pool
+
+The blueprint runs in a test Flask app whose tryton.pool holds generated
+templates, so no Tryton database is needed. The Whoosh catalog index is
+built in a temporary directory with the catalog indexer. For each catalog
+size and endpoint the latency percentiles, the queries per request (by
+kind) and the memory allocated per request are written as JSON:
+
+    python benchmarks/bench_views.py --sizes 1000,100000,1000000 \\
+        --output bench.json
+
+The blueprint requirements (trytond, python-sql, flask-babel,
+flask-paginate, galatea) must be installed, only the database is faked.
+Query times of the fake pool are not those of PostgreSQL: compare the
+query counts and the time spent in the blueprint between releases.
+Configuration values are overridden with --config KEY=JSON, e.g.
+--config TRYTON_CATALOG_RESPONSE_CACHE=true or
+--config 'TRYTON_CATALOG_CARD_TEMPLATE="catalog-product-card.html"'.
+'''
+import argparse
+import datetime
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import wraps
+
+from flask import Flask, g
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = 'galatea_catalog'
+BASE_DATE = datetime.datetime(2020, 1, 1)
+WORDS = ['word%d' % i for i in range(2000)]
+
+CONFIG = {
+    'SECRET_KEY': 'bench',
+    'BASE_URL': 'http://localhost',
+    'TRYTON_SALE_SHOP': 1,
+    'TRYTON_GALATEA_SITE': 1,
+    'WHOOSH_CATALOG_DIR': 'catalog',
+    }
+
+CARD_TEMPLATE = '''\
+<div class="product">
+  <a href="{{ url_for('catalog.product_' + g.language, lang=g.language,
+    slug=product.esale_slug) }}">{{ product.name }}</a>
+  {% if prefetch %}{{ prefetch[product.id].esale_price }}
+  {% else %}{{ product.esale_price }}{% endif %}
+</div>
+'''
+
+LISTING_TEMPLATE = '''\
+{% for product in products %}
+{% if cards and product.id in cards %}{{ cards[product.id] }}
+{% else %}{% include 'catalog-product-card.html' %}{% endif %}
+{% endfor %}
+{% if pagination %}{{ pagination.info }}{{ pagination.links }}{% endif %}
+'''
+
+TEMPLATES = {
+    'catalog-product-card.html': CARD_TEMPLATE,
+    'catalog.html': LISTING_TEMPLATE,
+    'catalog-key.html': LISTING_TEMPLATE,
+    'catalog-search.html': LISTING_TEMPLATE,
+    'catalog-category-product.html': LISTING_TEMPLATE,
+    'catalog-category.html': '''\
+{% for breadcrumb in breadcrumbs %}{{ breadcrumb.name }}{% endfor %}
+''',
+    'catalog-product.html': '''\
+<h1>{{ product.name }}</h1>
+<p>{{ product.esale_shortdescription }}</p>
+<p>{{ product.esale_price }}</p>
+{% for p in product.products %}{{ p.code }}{% endfor %}
+''',
+    }
+
+
+class QueryStats(object):
+    '''Queries run by the fake pool, by kind'''
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def count(self, kind):
+        self.counts[kind] += 1
+
+    def reset(self):
+        self.counts = Counter()
+
+
+STATS = QueryStats()
+
+
+def _hash(id_):
+    return (id_ * 2654435761) & 0xffffffff
+
+
+def _words(id_, size):
+    h = _hash(id_)
+    return ' '.join(WORDS[(h >> (3 * i)) % len(WORDS)] for i in range(size))
+
+
+def _compare(field_value, operator, value):
+    if operator == '=':
+        return field_value == value
+    elif operator == '!=':
+        return field_value != value
+    elif operator in ('in', 'not in'):
+        if isinstance(field_value, (list, tuple)):
+            found = any(v in value for v in field_value)
+        else:
+            found = field_value in value
+        return found if operator == 'in' else not found
+    elif operator in ('like', 'ilike'):
+        if field_value is None:
+            return False
+        pattern = value.strip('%')
+        if operator == 'ilike':
+            return pattern.lower() in field_value.lower()
+        return pattern in field_value
+    elif field_value is None or value is None:
+        return False
+    elif operator == '<':
+        return field_value < value
+    elif operator == '>':
+        return field_value > value
+    elif operator == '<=':
+        return field_value <= value
+    elif operator == '>=':
+        return field_value >= value
+    raise ValueError('Unsupported operator %s' % operator)
+
+
+class FakeModel(object):
+    '''Model of the fake pool with computed records
+
+    Records are ids 1 to _count and their values are computed from the id by
+    _columns (stored fields) and _functions (function fields). _constants are
+    the fields with the same value for all records and _lookups give the ids
+    of a clause like a database index. Relations are stored as ids.
+    '''
+    _name = None
+    _pool = None
+    _count = 0
+    _columns = {}
+    _functions = {}
+    _constants = {}
+    _relations = {}
+    _lookups = {}
+
+    def __init__(self, id=None, batch=None):
+        self.id = id
+        self._batch = batch if batch is not None else set()
+
+    def __getattr__(self, name):
+        cls = type(self)
+        if name.startswith('_') or name not in cls._fields:
+            raise AttributeError(name)
+        # values are read once per browsed list, function fields apart
+        key = name if name in cls._functions else None
+        if key not in self._batch:
+            self._batch.add(key)
+            STATS.count('function' if key else 'read')
+        value = cls._value(self.id, name)
+        if name in cls._relations:
+            Target = cls._pool.get(cls._relations[name])
+            if isinstance(value, list):
+                return Target.browse(value)
+            return Target(value) if value else None
+        return value
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.id == other.id
+
+    def __hash__(self):
+        return hash((self._name, self.id))
+
+    @classmethod
+    def _value(cls, id_, fname):
+        if fname == 'id':
+            return id_
+        elif fname == 'rec_name':
+            fname = 'name'
+        if fname in cls._constants:
+            return cls._constants[fname]
+        elif fname in cls._columns:
+            return cls._columns[fname](id_)
+        return cls._functions[fname](id_)
+
+    @classmethod
+    def _lookup(cls, fname, operator, value):
+        if fname == 'id':
+            values = [value] if operator == '=' else value
+            if operator not in ('=', 'in'):
+                return None
+            return sorted(set(int(v) for v in values
+                    if 1 <= int(v) <= cls._count))
+        lookup = cls._lookups.get(fname)
+        if lookup is not None:
+            return lookup(operator, value)
+        return None
+
+    @classmethod
+    def _match(cls, id_, clause):
+        if clause and clause[0] in ('OR', 'AND'):
+            return cls._match_domain(id_, clause)
+        elif clause and isinstance(clause[0], (list, tuple)):
+            return cls._match_domain(id_, clause)
+        fname, operator, value = clause
+        if '.' in fname:
+            fname, nested = fname.split('.', 1)
+            Target = cls._pool.get(cls._relations[fname])
+            return Target._match(cls._value(id_, fname),
+                (nested, operator, value))
+        return _compare(cls._value(id_, fname), operator, value)
+
+    @classmethod
+    def _match_domain(cls, id_, domain):
+        if domain and domain[0] == 'OR':
+            return any(cls._match(id_, c) for c in domain[1:])
+        return all(cls._match(id_, c) for c in domain if c != 'AND')
+
+    @classmethod
+    def _search_ids(cls, domain):
+        '''Return the ids matching domain and whether it is all the ids'''
+        ids = None
+        rest = []
+        if domain and domain[0] == 'OR':
+            rest = [domain]
+            domain = []
+        for clause in domain:
+            if clause == 'AND':
+                continue
+            if (len(clause) == 3 and clause[0] not in ('OR', 'AND')
+                    and not isinstance(clause[0], (list, tuple))):
+                fname, operator, value = clause
+                if fname in cls._constants:
+                    # evaluated once for all the records
+                    if not _compare(cls._constants[fname], operator, value):
+                        return [], False
+                    continue
+                found = cls._lookup(fname, operator, value)
+                if found is not None:
+                    if ids is None:
+                        ids = found
+                    else:
+                        found = set(found)
+                        ids = [i for i in ids if i in found]
+                    continue
+            rest.append(clause)
+        if ids is None:
+            ids = range(1, cls._count + 1)
+            if not rest:
+                return ids, True
+        return [i for i in ids
+            if all(cls._match(i, clause) for clause in rest)], False
+
+    @classmethod
+    def _ordered_ids(cls, ids, order, all_ids):
+        order = tuple((fname, direction) for fname, direction in order)
+        if order in ((), (('id', 'ASC'),)):
+            return ids
+        if all_ids and order in cls._orders:
+            return cls._orders[order]
+        ids = list(ids)
+        # sort by the last key first, sorts are stable
+        for fname, direction in reversed(order):
+            ids.sort(key=lambda i: (cls._value(i, fname) is None,
+                    cls._value(i, fname)), reverse=direction == 'DESC')
+        if all_ids:
+            # like a database index on the order
+            cls._orders[order] = ids
+        return ids
+
+    @classmethod
+    def search(cls, domain, offset=0, limit=None, order=None, count=False,
+            query=False):
+        if not query:
+            STATS.count('search_count' if count else 'search')
+        ids, all_ids = cls._search_ids(domain)
+        if count:
+            return len(ids)
+        ids = cls._ordered_ids(ids, order or [], all_ids)
+        end = offset + limit if limit is not None else None
+        if query:
+            # counted as a search when executed
+            return FakeQuery(ids[offset:end], len(ids))
+        return cls.browse(ids[offset:end])
+
+    @classmethod
+    def search_count(cls, domain):
+        return cls.search(domain, count=True)
+
+    @classmethod
+    def search_read(cls, domain, offset=0, limit=None, order=None,
+            fields_names=None):
+        STATS.count('search_read')
+        ids, all_ids = cls._search_ids(domain)
+        ids = cls._ordered_ids(ids, order or [], all_ids)
+        end = offset + limit if limit is not None else None
+        return cls._read(ids[offset:end], fields_names or [])
+
+    @classmethod
+    def read(cls, ids, fields_names):
+        STATS.count('read')
+        for fname in fields_names:
+            if fname in cls._functions:
+                STATS.count('function')
+        return cls._read(ids, fields_names)
+
+    @classmethod
+    def _read(cls, ids, fields_names):
+        result = []
+        for id_ in ids:
+            values = {'id': id_}
+            for fname in fields_names:
+                values[fname] = cls._value(id_, fname)
+            result.append(values)
+        return result
+
+    @classmethod
+    def browse(cls, ids):
+        batch = set()
+        return [cls(id_, batch) for id_ in ids]
+
+    @classmethod
+    def fields_get(cls, fields_names=None):
+        return dict((fname, {'searchable': True}) for fname in cls._fields)
+
+    @classmethod
+    def __table__(cls):
+        from sql import Table
+        return Table(cls._name.replace('.', '_'))
+
+
+def create_model(pool, name, count, columns=None, functions=None,
+        constants=None, relations=None, lookups=None):
+    attrs = {
+        '_name': name,
+        '_pool': pool,
+        '_count': count,
+        '_columns': columns or {},
+        '_functions': functions or {},
+        '_constants': constants or {},
+        '_relations': relations or {},
+        '_lookups': lookups or {},
+        '_orders': {},
+        }
+    fields = set(['id', 'rec_name'])
+    for key in ('_columns', '_functions', '_constants'):
+        fields.update(attrs[key])
+    attrs['_fields'] = dict((fname, None) for fname in fields)
+    return type(str(name.replace('.', '_')), (FakeModel,), attrs)
+
+
+def _parse_ids(prefix, count):
+    '''Lookup of the ids of values formatted as prefix + id'''
+    def lookup(operator, value):
+        if operator not in ('=', 'in'):
+            return None
+        values = [value] if operator == '=' else value
+        ids = set()
+        for value in values:
+            if value and value.startswith(prefix) \
+                    and value[len(prefix):].isdigit():
+                id_ = int(value[len(prefix):])
+                if 1 <= id_ <= count:
+                    ids.add(id_)
+        return sorted(ids)
+    return lookup
+
+
+class FakePool(object):
+    '''Stand-in of the Tryton pool with size generated templates'''
+
+    def __init__(self, size, menus, shop_id=1, website_id=1):
+        self.models = {}
+
+        def menu_ids(operator, value):
+            if operator != 'in':
+                return None
+            ids = []
+            for menu_id in value:
+                menu_id = int(menu_id)
+                if 1 <= menu_id <= menus:
+                    start = menu_id - 1 or menus
+                    ids.extend(range(start, size + 1, menus))
+            return sorted(ids)
+
+        def price(id_):
+            h = _hash(id_)
+            return Decimal('%d.%02d' % (h % 500 + 1, h % 100))
+
+        def images(id_):
+            return {'small': None, 'medium': None, 'big': None}
+
+        self.add(create_model(self, 'product.template', size,
+                columns={
+                    'name': lambda i: '%s %d' % (_words(i, 3), i),
+                    'esale_slug': lambda i: 'product-%d' % i,
+                    'esale_shortdescription': lambda i: _words(i, 6),
+                    'esale_description': lambda i: _words(i * 7, 10),
+                    'esale_metakeyword': lambda i: _words(i * 3, 2).replace(
+                        ' ', ', '),
+                    'esale_sequence': lambda i: _hash(i) % 1000,
+                    'esale_menus': lambda i: [i % menus + 1],
+                    'categories': lambda i: [],
+                    'products': lambda i: [i],
+                    'create_date': lambda i: BASE_DATE + datetime.timedelta(
+                        minutes=i),
+                    'write_date': lambda i: BASE_DATE + datetime.timedelta(
+                        minutes=i),
+                    },
+                functions={
+                    'esale_price': price,
+                    'esale_global_price': price,
+                    'esale_default_images': images,
+                    },
+                constants={
+                    'active': True,
+                    'salable': True,
+                    'esale_available': True,
+                    'esale_active': True,
+                    'shops': [shop_id],
+                    },
+                relations={'products': 'product.product'},
+                lookups={
+                    'esale_slug': _parse_ids('product-', size),
+                    'esale_menus': menu_ids,
+                    }))
+        self.add(create_model(self, 'product.product', size,
+                columns={
+                    'code': lambda i: 'P%07d' % i,
+                    'template': lambda i: i,
+                    },
+                constants={'active': True},
+                relations={'template': 'product.template'},
+                lookups={'code': _parse_ids('P', size)}))
+        self.add(create_model(self, 'esale.catalog.menu', menus,
+                columns={
+                    'slug': lambda i: 'menu-%d' % i,
+                    'name': lambda i: 'Menu %d' % i,
+                    'parent': lambda i: i // 10 or None,
+                    'default_sort_by': lambda i: ('name', 'position',
+                        'date')[i % 3],
+                    },
+                constants={'active': True, 'website': website_id},
+                relations={'parent': 'esale.catalog.menu'}))
+        self.add(create_model(self, 'product.category', 0))
+        self.add(create_model(self, 'galatea.website', 1,
+                columns={'name': lambda i: 'Website'}))
+        self.add(create_model(self, 'galatea.user', 0))
+        self.add(create_model(self, 'sale.shop', 1,
+                columns={'name': lambda i: 'Shop'}))
+
+    def add(self, Model):
+        self.models[Model._name] = Model
+
+    def get(self, name):
+        return self.models[name]
+
+
+class FakeQuery(object):
+    '''Stand-in of the select returned by a search with query=True
+
+    Executed by the fake cursor, its rows are the ids of the page with the
+    total of the search, like the count(*) OVER () column added by the
+    blueprint.
+    '''
+
+    def __init__(self, ids, total):
+        self.ids = ids
+        self.total = total
+        self.columns = ('id',)
+
+    def __iter__(self):
+        return iter((self, ()))
+
+
+class FakeCursor(object):
+
+    def __init__(self):
+        self.rows = None
+
+    def execute(self, query, params=None):
+        if isinstance(query, FakeQuery):
+            STATS.count('search')
+            self.rows = [(id_, query.total) for id_ in query.ids]
+        elif 'UNION ALL' in query:
+            # catalog versions: tag, last date and number of each model
+            STATS.count('execute')
+            self.rows = [(i, BASE_DATE, 0)
+                for i in range(query.count('UNION ALL') + 1)]
+        else:
+            STATS.count('execute')
+            self.rows = None
+
+    def fetchone(self):
+        if self.rows is not None:
+            return self.rows[0] if self.rows else None
+        return (BASE_DATE,)
+
+    def fetchall(self):
+        if self.rows is not None:
+            return self.rows
+        return [(BASE_DATE,)]
+
+
+class FakeConnection(object):
+
+    def cursor(self):
+        return FakeCursor()
+
+
+class FakeTransaction(object):
+    '''Stand-in of trytond.transaction.Transaction, one per thread'''
+    _local = threading.local()
+    connection = FakeConnection()
+
+    def __new__(cls):
+        transaction = getattr(cls._local, 'transaction', None)
+        if transaction is None:
+            transaction = cls._local.transaction = object.__new__(cls)
+            transaction.context = {}
+        return transaction
+
+    @property
+    def language(self):
+        return self.context.get('language') or 'en'
+
+    @contextmanager
+    def set_context(self, context=None, **kwargs):
+        previous = self.context
+        self.context = dict(previous, **dict(context or {}, **kwargs))
+        try:
+            yield self
+        finally:
+            self.context = previous
+
+
+class FakeTryton(object):
+    '''Stand-in of the app_extensions tryton extension'''
+
+    def __init__(self):
+        self.pool = None
+
+    def transaction(self, readonly=None, user=None, context=None):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with FakeTransaction().set_context(context,
+                        language=getattr(g, 'language', None)):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+def load_blueprint(tryton):
+    '''Import the blueprint package with the fake tryton extension'''
+    app_extensions = types.ModuleType('app_extensions')
+    app_extensions.tryton = tryton
+    sys.modules['app_extensions'] = app_extensions
+
+    spec = importlib.util.spec_from_file_location(PACKAGE,
+        os.path.join(BASEDIR, '__init__.py'),
+        submodule_search_locations=[BASEDIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = package
+    spec.loader.exec_module(package)
+    modules = dict((name, importlib.import_module('%s.%s' % (PACKAGE, name)))
+        for name in ('catalog', 'indexer', 'cache', 'search_index'))
+    for name in ('catalog', 'indexer'):
+        modules[name].Transaction = FakeTransaction
+    return modules
+
+
+def create_app(modules, workdir, database, config):
+    from flask_babel import Babel
+
+    app = Flask('catalog_bench',
+        template_folder=os.path.join(workdir, 'templates'))
+    app.config.update(CONFIG)
+    app.config.update(config)
+    app.config['TRYTON_DATABASE'] = database
+    app.config['TRYTON_CATALOG_CACHE_STAMP_DIR'] = os.path.join(workdir,
+        database, 'catalog-cache')
+    Babel(app)
+
+    @app.url_value_preprocessor
+    def pull_language(endpoint, values):
+        g.language = (values or {}).get('lang', 'en')
+
+    app.register_blueprint(modules['catalog'].catalog,
+        url_prefix='/<lang>/catalog')
+    return app
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1,
+            int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+def summary(values, scale=1):
+    return {
+        'p50': percentile(values, 50) * scale,
+        'p90': percentile(values, 90) * scale,
+        'p99': percentile(values, 99) * scale,
+        'mean': sum(values) * scale / len(values),
+        'max': max(values) * scale,
+        }
+
+
+def request(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError('GET %s returned %s' % (url,
+                response.status_code))
+    return response
+
+
+def bench_endpoint(client, urls, runs, warmup, alloc_runs):
+    for url in urls[:warmup]:
+        request(client, url)
+
+    timings = []
+    queries = []
+    kinds = Counter()
+    for i in range(runs):
+        url = urls[i % len(urls)]
+        STATS.reset()
+        start = time.perf_counter()
+        request(client, url)
+        timings.append(time.perf_counter() - start)
+        queries.append(sum(STATS.counts.values()))
+        kinds.update(STATS.counts)
+
+    # apart, tracing slows down the requests
+    peaks = []
+    retained = []
+    for i in range(alloc_runs):
+        url = urls[i % len(urls)]
+        tracemalloc.start()
+        try:
+            request(client, url)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peaks.append(peak)
+        retained.append(current)
+
+    result = {
+        'requests': runs,
+        'latency_ms': summary(timings, 1000),
+        'queries': dict(summary(queries),
+            by_kind=dict((kind, float(count) / runs)
+                for kind, count in kinds.items())),
+        }
+    if alloc_runs:
+        result['allocated_kib'] = {
+            'peak': summary(peaks, 1 / 1024.0),
+            'retained': summary(retained, 1 / 1024.0),
+            }
+    return result
+
+
+def endpoint_urls(size, menus, count, seed=0):
+    rnd = random.Random(seed)
+    pages = max(1, min(10, size // CONFIG.get(
+                'TRYTON_PAGINATION_CATALOG_LIMIT', 20)))
+    ids = [rnd.randint(1, size) for _ in range(count)]
+    return {
+        'catalog_all': ['/en/catalog/?page=%d' % (i % pages + 1)
+            for i in range(count)],
+        'category_products': ['/en/catalog/category/menu-%d'
+            % rnd.randint(1, menus) for _ in range(count)],
+        'product': ['/en/catalog/product/product-%d' % i for i in ids],
+        'product_json': ['/en/catalog/json/product-%d' % i for i in ids],
+        'search': ['/en/catalog/search/?q=%s' % rnd.choice(WORDS)
+            for _ in range(count)],
+        }
+
+
+def bench_size(modules, tryton, workdir, size, args, config):
+    menus = args.menus or max(10, size // 1000)
+    tryton.pool = FakePool(size, menus)
+    database = 'bench%d' % size
+    app = create_app(modules, workdir, database, config)
+
+    start = time.perf_counter()
+    modules['indexer'].index_language(app, 'en', full=True)
+    index_time = time.perf_counter() - start
+
+    for cache in list(modules['cache']._CACHES.values()):
+        cache.clear()
+    try:
+        client = app.test_client()
+        endpoints = {}
+        urls = endpoint_urls(size, menus, max(args.runs, args.warmup))
+        for endpoint in args.endpoints:
+            endpoints[endpoint] = bench_endpoint(client, urls[endpoint],
+                args.runs, args.warmup, args.alloc_runs)
+    finally:
+        modules['search_index'].close_searchers()
+    return {
+        'templates': size,
+        'menus': menus,
+        'index_seconds': index_time,
+        'endpoints': endpoints,
+        }
+
+
+def parse_config(values):
+    config = {}
+    for value in values:
+        key, _, value = value.partition('=')
+        config[key] = json.loads(value)
+    return config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,100000',
+        help='comma separated numbers of templates')
+    parser.add_argument('--menus', type=int, default=None,
+        help='number of menus, one per 1000 templates by default')
+    parser.add_argument('--endpoints', default=','.join(sorted(
+                endpoint_urls(1, 1, 0))))
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--alloc-runs', type=int, default=20)
+    parser.add_argument('--config', action='append', default=[],
+        metavar='KEY=JSON')
+    parser.add_argument('--output', type=argparse.FileType('w'),
+        default=sys.stdout)
+    args = parser.parse_args(argv)
+    args.endpoints = args.endpoints.split(',')
+    config = parse_config(args.config)
+
+    from trytond.config import config as tryton_config
+
+    tryton = FakeTryton()
+    modules = load_blueprint(tryton)
+    workdir = tempfile.mkdtemp(prefix='catalog-bench-')
+    try:
+        tryton_config.set('database', 'path', workdir)
+        os.mkdir(os.path.join(workdir, 'templates'))
+        for name, source in TEMPLATES.items():
+            with open(os.path.join(workdir, 'templates', name), 'w') as f:
+                f.write(source)
+        results = {}
+        for size in [int(s) for s in args.sizes.split(',')]:
+            results[str(size)] = bench_size(modules, tryton, workdir, size,
+                args, config)
+    finally:
+        shutil.rmtree(workdir)
+
+    json.dump({
+            'python': platform.python_version(),
+            'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'runs': args.runs,
+            'config': dict(CONFIG, **config),
+            'sizes': results,
+            }, args.output, indent=2, sort_keys=True)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
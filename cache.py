@@ -0,0 +1,162 @@
+'''In-process caches of the catalog blueprint'''
+from collections import OrderedDict
+from threading import Lock
+import binascii
+import os
+import time
+
+_CACHES = {}
+_CACHES_LOCK = Lock()
+
+
+class LRUCache(object):
+    '''Thread-safe LRU mapping with an optional time to live
+
+    maxsize bounds the sum of the weights of the entries. weigh is called
+    with each stored value and defaults to 1 per entry, so maxsize is then
+    the number of entries.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh or (lambda value: 1)
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, weight, expire = entry
+        if expire is not None and expire < now:
+            del self._data[key]
+            self.weight -= weight
+            return None
+        # move to the most recently used end
+        del self._data[key]
+        self._data[key] = entry
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key, time.time())
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[0]
+
+    def get_many(self, keys):
+        '''Return a dict with the values of the keys found in the cache'''
+        result = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._lookup(key, now)
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    result[key] = entry[0]
+        return result
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        weight = self.weigh(value)
+        if weight > self.maxsize:
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        expire = time.time() + ttl if ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= old[1]
+            self._data[key] = (value, weight, expire)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                _, (_, old_weight, _) = self._data.popitem(last=False)
+                self.weight -= old_weight
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self.weight -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._data),
+            'weight': self.weight,
+            'maxsize': self.maxsize,
+            }
+
+
+class CacheStamp(object):
+    '''Version of cached data shared between processes
+
+    The version is the modification time and the content of a file, so any
+    process (the Tryton server or an indexer included) invalidates the
+    caches keyed on it by touching the file. touch also writes a new token
+    in it, so invalidations within the time resolution of the file system
+    are not lost. The file is checked at most every interval seconds.
+    '''
+
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = interval
+        self._version = None
+        self._checked = 0
+
+    def version(self):
+        now = time.time()
+        if self._version is None or now - self._checked >= self.interval:
+            try:
+                with open(self.path) as f:
+                    self._version = (os.fstat(f.fileno()).st_mtime,
+                        f.read())
+            except (IOError, OSError):
+                self._version = 0
+            self._checked = now
+        return self._version
+
+    def touch(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self.path, 'w') as f:
+            f.write('%r %s %s' % (time.time(), os.getpid(),
+                    binascii.hexlify(os.urandom(8)).decode('ascii')))
+        self._version = None
+
+
+def get_cache(name, maxsize=1024, ttl=None, weigh=None):
+    '''Return the process cache called name, creating it on first use'''
+    cache = _CACHES.get(name)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.get(name)
+            if cache is None:
+                cache = _CACHES[name] = LRUCache(maxsize, ttl, weigh)
+    return cache
+
+
+def caches_stats():
+    '''Return the hit/miss counters of all process caches by name'''
+    return dict((name, cache.stats()) for name, cache in _CACHES.items())
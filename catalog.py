@@ -1,14 +1,37 @@
-from flask import Blueprint, render_template, current_app, abort, g, \
-    request, url_for, jsonify, session, flash
+from flask import Blueprint, current_app, abort, g, \
+    request, url_for, jsonify, session, flash, make_response, Response, \
+    stream_with_context, render_template as _render_template
 from app_extensions import tryton
 from galatea.utils import thumbnail
-from galatea.helpers import cached
 from flask_paginate import Pagination
 from flask_babel import gettext as _, lazy_gettext
 from trytond.transaction import Transaction
 from trytond.config import config as tryton_config
-from whoosh import index
+from trytond.model.fields import Function, Many2One
+from sql import Literal, Window, Union, Select
+from sql.functions import CurrentTimestamp
+from sql.aggregate import Count, Max
+from sql.conditionals import Coalesce
 from whoosh.qparser import MultifieldParser
+from markupsafe import Markup
+from .search_index import get_index, pooled_searcher, search_ids, \
+    normalize_query, sortable_columns, ngram_fields, substring_clause, \
+    get_prefix_index
+from .cache import get_cache, caches_stats, CacheStamp
+from .catalog_index import MenuTree, MembershipIndex, FacetIndex, \
+    KeywordIndex, ids_bitmap, bitmap_ids
+from .timing import timed, RequestTimings, record_timings, timings_stats
+from threading import Lock
+from functools import wraps
+from xml.sax.saxutils import escape
+from decimal import Decimal
+import base64
+import csv
+import datetime
+import io
+import hashlib
+import json
+import time
 import os
 
 catalog = Blueprint('catalog', __name__, template_folder='templates')
@@ -17,6 +40,24 @@ DISPLAY_MSG = lazy_gettext('Displaying <b>{start} - {end}</b> of <b>{total}</b>'
 
 CATALOG_TEMPLATE_FILTERS = []
 
+# default direction of the catalog order fields (ASC otherwise)
+CATALOG_ORDER_DIRECTIONS = {
+    'create_date': 'DESC',
+    'write_date': 'DESC',
+    }
+
+_CATALOG_ORDER_FIELDS = {}
+_CACHE_STAMPS = {}
+
+# request arguments stored in the session by the listing views
+CATALOG_SESSION_ARGS = {
+    'limit': 'catalog_limit',
+    'view': 'catalog_view',
+    'order': 'catalog_order',
+    }
+_MEMBERSHIP_INDEXES = {}
+_MEMBERSHIP_LOCK = Lock()
+
 
 def get_shop_id():
     return current_app.config.get('TRYTON_SALE_SHOP')
@@ -49,16 +90,321 @@ def get_catalog_schema_parse_fields():
 def get_catalog_search_add_wildcard():
     return current_app.config.get('TRYTON_CATALOG_SEARCH_ADD_WILDCARD', False)
 
+
+def get_catalog_schema_ngram_fields():
+    '''N-gram fields of the catalog index used for substring matching'''
+    return current_app.config.get('TRYTON_CATALOG_SCHEMA_NGRAM_FIELDS',
+        ['title_ngram', 'content_ngram'])
+
+
+def get_catalog_search_relevance():
+    return current_app.config.get('TRYTON_CATALOG_SEARCH_RELEVANCE', False)
+
+
+def get_catalog_schema_sort_fields():
+    '''Template fields stored as sortable columns in the catalog index'''
+    return current_app.config.get('TRYTON_CATALOG_SCHEMA_SORT_FIELDS',
+        ['name', 'create_date', 'write_date'])
+
+
+def get_catalog_suggest_fields():
+    '''Stored catalog index fields giving the suggest prefixes
+
+    The first field is the product name returned by suggest'''
+    return current_app.config.get('TRYTON_CATALOG_SUGGEST_FIELDS',
+        ['title', 'code'])
+
+
+def get_catalog_suggest_limit():
+    return current_app.config.get('TRYTON_CATALOG_SUGGEST_LIMIT', 10)
+
+
+def get_catalog_window_count():
+    return current_app.config.get('TRYTON_CATALOG_WINDOW_COUNT', True)
+
+
+def get_whoosh_searcher_pool_size():
+    return current_app.config.get('WHOOSH_SEARCHER_POOL_SIZE', 4)
+
+
+def get_whoosh_query_cache_size():
+    '''Bound of the search results cache, in number of cached ids'''
+    return current_app.config.get('WHOOSH_QUERY_CACHE_SIZE', 100000)
+
+
+def get_whoosh_query_cache_timeout():
+    return current_app.config.get('WHOOSH_QUERY_CACHE_TIMEOUT', 600)
+
+
+def get_catalog_slug_cache_size():
+    return current_app.config.get('TRYTON_CATALOG_SLUG_CACHE_SIZE', 10000)
+
+
+def get_catalog_slug_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_SLUG_CACHE_TIMEOUT', 3600)
+
+
+def get_catalog_slug_cache_miss_timeout():
+    return current_app.config.get('TRYTON_CATALOG_SLUG_CACHE_MISS_TIMEOUT', 300)
+
+
+def get_catalog_cache_stamp(scope):
+    '''Stamp shared by the processes caching catalog data of a scope'''
+    db_name = current_app.config.get('TRYTON_DATABASE')
+    stamp_dir = current_app.config.get('TRYTON_CATALOG_CACHE_STAMP_DIR') or \
+        os.path.join(tryton_config.get('database', 'path'), db_name,
+            'catalog-cache')
+    path = os.path.join(stamp_dir, scope)
+    stamp = _CACHE_STAMPS.get(path)
+    if stamp is None:
+        stamp = _CACHE_STAMPS[path] = CacheStamp(path)
+    return stamp
+
+
+def invalidate_catalog_cache(scope='products'):
+    '''Invalidate the cached catalog data of a scope in all processes'''
+    get_catalog_cache_stamp(scope).touch()
+
+
+def get_catalog_menu_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_MENU_CACHE_TIMEOUT', 3600)
+
+
+def get_catalog_membership_index():
+    return current_app.config.get('TRYTON_CATALOG_MEMBERSHIP_INDEX', False)
+
+
+def get_catalog_membership_sort_fields():
+    '''Template fields kept by the membership index to sort the listings'''
+    return current_app.config.get('TRYTON_CATALOG_MEMBERSHIP_SORT_FIELDS',
+        ['name', 'create_date', 'write_date', 'esale_sequence'])
+
+
+def get_catalog_membership_sync_interval():
+    return current_app.config.get('TRYTON_CATALOG_MEMBERSHIP_SYNC_INTERVAL', 60)
+
+
+def get_catalog_sync_overlap():
+    '''Seconds of changes read again by each sync
+
+    write_date is the start of the writing transaction, so a change
+    committed after a sync may be dated before it.
+    '''
+    return current_app.config.get('TRYTON_CATALOG_SYNC_OVERLAP', 300)
+
+
+def get_catalog_facets():
+    return current_app.config.get('TRYTON_CATALOG_FACETS', False)
+
+
+def get_catalog_facet_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_FACET_CACHE_TIMEOUT', 600)
+
+
+def get_catalog_keyword_index():
+    return current_app.config.get('TRYTON_CATALOG_KEYWORD_INDEX', False)
+
+
+def get_catalog_keyword_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_KEYWORD_CACHE_TIMEOUT', 600)
+
+
+def get_catalog_response_cache():
+    return current_app.config.get('TRYTON_CATALOG_RESPONSE_CACHE', False)
+
+
+def get_catalog_response_cache_size():
+    return current_app.config.get('TRYTON_CATALOG_RESPONSE_CACHE_SIZE', 500)
+
+
+def get_catalog_response_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def get_catalog_product_json_cache_size():
+    return current_app.config.get('TRYTON_CATALOG_PRODUCT_JSON_CACHE_SIZE', 5000)
+
+
+def get_catalog_product_json_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_PRODUCT_JSON_CACHE_TIMEOUT', 86400)
+
+
+def get_catalog_product_json_batch_limit():
+    return current_app.config.get('TRYTON_CATALOG_PRODUCT_JSON_BATCH_LIMIT', 100)
+
+
+def get_catalog_export_chunk_size():
+    return current_app.config.get('TRYTON_CATALOG_EXPORT_CHUNK_SIZE', 500)
+
+
+def get_catalog_sitemap_size():
+    '''Number of urls by sitemap, at most the 50,000 of the protocol'''
+    return min(current_app.config.get('TRYTON_CATALOG_SITEMAP_SIZE', 50000),
+        50000)
+
+
+def get_catalog_timing():
+    return current_app.config.get('TRYTON_CATALOG_TIMING', False)
+
+
+def get_catalog_timing_hook():
+    '''Callable receiving the name, milliseconds and calls of each phase'''
+    return current_app.config.get('TRYTON_CATALOG_TIMING_HOOK')
+
+
+def get_catalog_timing_endpoint():
+    return current_app.config.get('TRYTON_CATALOG_TIMING_ENDPOINT', False)
+
+
+def get_catalog_card_template():
+    '''Template of the product cards cached by product_cards or None'''
+    return current_app.config.get('TRYTON_CATALOG_CARD_TEMPLATE')
+
+
+def get_catalog_card_cache_size():
+    return current_app.config.get('TRYTON_CATALOG_CARD_CACHE_SIZE', 5000)
+
+
+def get_catalog_card_cache_timeout():
+    return current_app.config.get('TRYTON_CATALOG_CARD_CACHE_TIMEOUT', 3600)
+
+
+def get_catalog_schema_dir(lang):
+    '''Whoosh catalog index directory of a language or None'''
+    WHOOSH_CATALOG_DIR = current_app.config.get('WHOOSH_CATALOG_DIR')
+    if not WHOOSH_CATALOG_DIR:
+        return None
+    db_name = current_app.config.get('TRYTON_DATABASE')
+    return os.path.join(tryton_config.get('database', 'path'),
+        db_name, 'whoosh', WHOOSH_CATALOG_DIR, lang)
+
+
+def parse_catalog_query(q, schema):
+    '''Parse a user query string against the catalog index schema'''
+    query = q.replace('+', ' AND ').replace('-', ' NOT ')
+    if get_catalog_search_add_wildcard():
+        ngrams = ngram_fields(schema, get_catalog_schema_ngram_fields())
+        phrases = []
+        for phrase in query.split('"')[1::2]:
+            phrases.append('"' + phrase + '"')
+        words = []
+        for word in ' '.join(query.split('"')[0::2]).split():
+            if word and word not in ['AND', 'NOT', 'OR']:
+                word = substring_clause(word, schema, ngrams,
+                    get_catalog_schema_parse_fields())
+            words.append(word)
+        query = " ".join(phrases + words)
+    return MultifieldParser(get_catalog_schema_parse_fields(), schema).parse(query)
+
+
+def search_catalog_ids(schema_dir, q, sortedby=None):
+    '''Template ids matching q in the catalog index
+
+    Ids are in relevance order or sorted by sortedby, a tuple of
+    (column, reverse) pairs of sortable index columns.
+    Results are cached by normalized query and index generation, so a new
+    generation on disk invalidates them.
+    '''
+    ix = get_index(schema_dir)
+    key = (schema_dir, ix.latest_generation(), normalize_query(q),
+        get_catalog_search_add_wildcard(), sortedby)
+    cache = get_cache('catalog-search', get_whoosh_query_cache_size(),
+        get_whoosh_query_cache_timeout(), weigh=lambda ids: len(ids) + 1)
+    ids = cache.get(key)
+    if ids is None:
+        with timed('whoosh'):
+            query = parse_catalog_query(q, ix.schema)
+            with pooled_searcher(schema_dir,
+                    get_whoosh_searcher_pool_size()) as s:
+                ids = tuple(search_ids(s, query, get_whoosh_max_limit(),
+                        sortedby))
+        cache.set(key, ids)
+    return ids
+
+def catalog_query_ids(lang, q):
+    '''Template ids matching q in the catalog index of lang
+
+    Return None when there is no catalog index. Like the search view, only
+    the WHOOSH_MAX_LIMIT best hits are returned.
+    '''
+    schema_dir = get_catalog_schema_dir(lang)
+    if not schema_dir or get_index(schema_dir) is None:
+        return None
+    return search_catalog_ids(schema_dir, q)
+
+
+def search_ordered():
+    '''Search Product Order
+
+    None when products are sorted by relevance, else the catalog order'''
+    option_order = request.args.get('order')
+    if option_order == 'relevance' or (not option_order
+            and get_catalog_search_relevance()):
+        return None
+    return catalog_ordered()
+
+
+def search_sortedby(schema, order):
+    '''Sortable index columns of a catalog order or None'''
+    fields = [o[0] for o in order]
+    if (not set(fields) <= set(get_catalog_schema_sort_fields())
+            or not sortable_columns(schema, fields)):
+        return None
+    return tuple((fname, direction == 'DESC') for fname, direction in order)
+
+
+def catalog_order_fields():
+    '''Template fields allowed as catalog order, by language
+
+    fields_get is only called once per language and Tryton pool: a reloaded
+    pool has new model classes, which rebuilds the registry.
+    '''
+    Template = tryton.pool.get('product.template')
+    language = Transaction().language
+    registry = _CATALOG_ORDER_FIELDS.get(language)
+    if registry is None or registry['model'] is not Template:
+        fields = Template.fields_get([])
+        registry = {
+            'model': Template,
+            'fields': frozenset(k for k, v in fields.items()
+                if v['searchable']),
+            }
+        _CATALOG_ORDER_FIELDS[language] = registry
+    return registry['fields']
+
+
+def set_session(key, value, default=None):
+    '''Store value in the session only when it changes
+
+    A value equal to default is removed instead, so the session is only
+    written (and a cookie sent) when the catalog state really changes.
+    '''
+    if value == default:
+        if key in session:
+            del session[key]
+    elif session.get(key) != value:
+        session[key] = value
+
+
+def set_session_next(url):
+    '''Remember url to come back after login
+
+    Anonymous visitors without session are not given one for it, so the
+    catalog pages they get stay cookie-free and shareable.
+    '''
+    if session:
+        set_session('next', url)
+
+
 def catalog_ordered(default='name'):
     '''Catalog Product Order'''
-    Template = tryton.pool.get('product.template')
     if request.args.get('order'):
         option_order = request.args.get('order')
         if session.get('catalog_order') == option_order:
             order = option_order
         else:
             # check param is a field searchable
-            if option_order in [k for k, v in Template().fields_get([]).items() if v['searchable']]:
+            if option_order in catalog_order_fields():
                 order = option_order
                 session['catalog_order'] = order
             elif session.get('catalog_order'):
@@ -72,14 +418,12 @@ def catalog_ordered(default='name'):
 
     order_direction = request.args.get('order_direction')
     if order_direction not in ['ASC', 'DESC']:
-        if order == 'create_date' or order == 'write_date':
-            order_direction = 'DESC'
-        else:
-            order_direction = 'ASC'
-    session['catalog_order_direction'] = order_direction
+        order_direction = CATALOG_ORDER_DIRECTIONS.get(order, 'ASC')
+    set_session('catalog_order_direction', order_direction,
+        CATALOG_ORDER_DIRECTIONS.get(order, 'ASC'))
 
     if order != 'name':
-        if order == 'create_date' or order == 'write_date':
+        if order in CATALOG_ORDER_DIRECTIONS:
             order = [(order, order_direction), ('name', 'ASC')]
         else:
             order = [(order, order_direction), ('name', order_direction)]
@@ -87,17 +431,146 @@ def catalog_ordered(default='name'):
         order = [('name', order_direction)]
     return order
 
-@catalog.route("/json/<slug>", endpoint="product_json")
-@tryton.transaction()
-@cached(3500, 'catalog-product-detail-json')
-def product_json(lang, slug):
-    '''Product JSON Details
+def catalog_versions():
+    '''Last write or create date and number of the templates, variants, menus
+    and categories
 
-    slug param is a product slug or a product code
+    The numbers change when records are deleted.
     '''
     Template = tryton.pool.get('product.template')
     Product = tryton.pool.get('product.product')
-    with Transaction().set_context(without_special_price=True):
+    Menu = tryton.pool.get('esale.catalog.menu')
+    Category = tryton.pool.get('product.category')
+
+    queries = []
+    for i, Model in enumerate((Template, Product, Menu, Category)):
+        table = Model.__table__()
+        queries.append(table.select(Literal(i),
+                Max(Coalesce(table.write_date, table.create_date)),
+                Count(Literal('*'))))
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*Union(*queries, all_=True))
+    return tuple(tuple(row[1:]) for row in sorted(cursor.fetchall()))
+
+
+def catalog_response_cached(name):
+    '''Conditional GET and response cache of anonymous catalog pages
+
+    The ETag of a page depends on its url, the language, the shop, the
+    catalog state kept in the session and the last modification of the
+    catalog and of the prices. A matching If-None-Match, or without it an
+    If-Modified-Since not older than the last modification, gets a 304 Not
+    Modified and otherwise the body rendered for the same ETag is served
+    from the cache. Sessions holding anything else than the catalog state
+    (cart, CSRF token...) are never cached.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            if (not get_catalog_response_cache()
+                    or request.method != 'GET'
+                    or session.get('user')
+                    or session.get('_flashes')
+                    or request.args.get('q')):
+                return func(*args, **kwargs)
+            # the view must run to store the new values in the session
+            for arg, skey in CATALOG_SESSION_ARGS.items():
+                if (request.args.get(arg)
+                        and request.args.get(arg) != str(session.get(skey))):
+                    return func(*args, **kwargs)
+
+            skeys = sorted(CATALOG_SESSION_ARGS.values()) + [
+                'catalog_filter', 'catalog_order_direction']
+            if any(skey not in skeys and skey != '_permanent'
+                    for skey in session.keys()):
+                return func(*args, **kwargs)
+            state = tuple((skey, repr(session.get(skey))) for skey in skeys)
+            versions = catalog_versions()
+            dates = [date for date, count in versions if date]
+            last_modified = max(dates) if dates else None
+            price_version = catalog_price_version()
+            if price_version and (not last_modified
+                    or price_version > last_modified):
+                last_modified = price_version
+            key = (name, request.path,
+                tuple(sorted(request.args.items(multi=True))),
+                g.language, get_shop_id(), state)
+            etag = hashlib.sha1(repr((key, versions, price_version,
+                            get_catalog_cache_stamp('products').version(),
+                            get_catalog_cache_stamp('menus').version())
+                        ).encode('utf-8')).hexdigest()
+
+            since = request.if_modified_since
+            if since is not None and since.utcoffset() is not None:
+                since = since.replace(tzinfo=None) - since.utcoffset()
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                # HTTP dates have no microseconds
+                not_modified = bool(since and last_modified
+                    and since >= last_modified.replace(microsecond=0))
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                cache = get_cache('catalog-responses',
+                    get_catalog_response_cache_size(),
+                    get_catalog_response_cache_timeout())
+                cached = cache.get(key)
+                if cached is not None and cached[0] == etag:
+                    response = make_response(cached[1])
+                else:
+                    response = make_response(func(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    cache.set(key, (etag, response.get_data()))
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.max_age = 0
+            response.cache_control.must_revalidate = True
+            # pages depending on the session state are not shared
+            if any(session.get(skey) for skey in skeys):
+                response.cache_control.private = True
+            else:
+                response.cache_control.public = True
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
+
+def resolve_product(slug):
+    '''Product template of a slug or a product code
+
+    Return None when no salable template of the shop matches. Template ids
+    and misses are cached by shop, language and slug. A cached id is only
+    used while the write_date of the template is unchanged, and
+    invalidate_catalog_cache('products') drops all the entries.
+    '''
+    Template = tryton.pool.get('product.template')
+    Product = tryton.pool.get('product.product')
+
+    cache = get_cache('catalog-slug', get_catalog_slug_cache_size(),
+        get_catalog_slug_cache_timeout())
+    key = (get_shop_id(), Transaction().language, slug,
+        get_catalog_cache_stamp('products').version())
+
+    cached = cache.get(key)
+    if cached is not None:
+        template_id, write_date = cached
+        if template_id is None:
+            return None
+        with Transaction().set_context(without_special_price=True):
+            product = Template(template_id)
+        try:
+            if product.write_date == write_date:
+                return product
+        except Exception:
+            # template deleted
+            pass
+        cache.pop(key)
+
+    with Transaction().set_context(without_special_price=True), \
+            timed('search'):
         products = Template.search([
             ('salable', '=', True),
             ('esale_available', '=', True),
@@ -112,7 +585,8 @@ def product_json(lang, slug):
 
     if not product:
         # search product by code
-        with Transaction().set_context(without_special_price=True):
+        with Transaction().set_context(without_special_price=True), \
+                timed('search'):
             products = Product.search([
                 ('template.esale_available', '=', True),
                 ('code', '=', slug),
@@ -122,9 +596,406 @@ def product_json(lang, slug):
             if products:
                 product = products[0].template
 
-    if not product:
-        abort(404)
+    if product:
+        cache.set(key, (product.id, product.write_date))
+    else:
+        cache.set(key, (None, None), get_catalog_slug_cache_miss_timeout())
+    return product
+
+def search_templates(domain, offset, limit, order):
+    '''Page of catalog templates and total of the domain
+
+    The total is a count(*) OVER () column of the search query, so both come
+    from a single query. A page past the end has no rows to carry the total,
+    which is then counted apart.
+    '''
+    Template = tryton.pool.get('product.template')
+
+    if not get_catalog_window_count():
+        with timed('search_count'):
+            total = Template.search_count(domain)
+        with Transaction().set_context(without_special_price=True), \
+                timed('search'):
+            products = Template.search(domain, offset, limit, order)
+        return products, total
+
+    with Transaction().set_context(without_special_price=True), \
+            timed('search'):
+        query = Template.search(domain, offset, limit, order, query=True)
+        query.columns += (Count(Literal('*'), window=Window([])),)
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*query)
+        rows = cursor.fetchall()
+        products = Template.browse([row[0] for row in rows])
+
+    if rows:
+        total = rows[0][-1]
+    elif offset:
+        with timed('search_count'):
+            total = Template.search_count(domain)
+    else:
+        total = 0
+    return products, total
+
+def search_template_ids(domain):
+    '''Ids of the templates of domain, read without browsing them'''
+    Template = tryton.pool.get('product.template')
+
+    with timed('search'):
+        query = Template.search(domain, order=[], query=True)
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*query)
+        return [row[0] for row in cursor.fetchall()]
+
+def encode_cursor(values, offset):
+    '''Cursor of a listing position: sort key values and offset'''
+    def encode(value):
+        if isinstance(value, Decimal):
+            return {'decimal': str(value)}
+        elif isinstance(value, datetime.datetime):
+            return {'datetime': value.strftime('%Y-%m-%d %H:%M:%S.%f')}
+        elif isinstance(value, datetime.date):
+            return {'date': value.strftime('%Y-%m-%d')}
+        return value
+    if values is not None:
+        values = [encode(v) for v in values]
+    data = json.dumps({'k': values, 'o': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''Sort key values and offset of a cursor or None when invalid'''
+    def decode(value):
+        if isinstance(value, dict):
+            if 'decimal' in value:
+                return Decimal(value['decimal'])
+            elif 'datetime' in value:
+                return datetime.datetime.strptime(value['datetime'],
+                    '%Y-%m-%d %H:%M:%S.%f')
+            elif 'date' in value:
+                return datetime.datetime.strptime(value['date'],
+                    '%Y-%m-%d').date()
+        return value
+    try:
+        data = json.loads(base64.urlsafe_b64decode(
+                cursor.encode('ascii')).decode('utf-8'))
+        values = data['k']
+        if values is not None:
+            values = [decode(v) for v in values]
+        return values, int(data['o'])
+    except Exception:
+        return None
+
+
+# whether NULL values sort after the others, by direction (PostgreSQL)
+KEYSET_NULLS_LAST = {
+    'ASC': True,
+    'DESC': False,
+    }
+
+
+def keyset_domain(order, values, nullable=()):
+    '''Domain of the rows after values in order
+
+    values must not be None. Rows with NULL in a field of nullable come
+    after them when NULLs sort last in the direction of the field.
+    '''
+    domain = ['OR']
+    for i, (fname, direction) in enumerate(order):
+        clause = [(o[0], '=', v) for o, v in zip(order[:i], values[:i])]
+        after = (fname, '<' if direction == 'DESC' else '>', values[i])
+        if fname in nullable and KEYSET_NULLS_LAST[direction]:
+            after = ['OR', after, (fname, '=', None)]
+        clause.append(after)
+        domain.append(clause)
+    return domain
+
+
+def search_templates_cursor(domain, cursor, limit, order):
+    '''Page of catalog templates after a cursor and the next page cursor
+
+    The cursor holds the sort key of the last row of the previous page, so
+    the page is read with a keyset domain and costs the same at any depth.
+    Orders on function or many2one fields (sorted by their target) or a
+    last row with empty sort values fall back to the offset also held by
+    the cursor.
+    '''
+    Template = tryton.pool.get('product.template')
+
+    # id breaks the ties of the catalog order
+    order = list(order) + [('id', order[-1][1])]
+    keyset = all(fname in Template._fields
+        and not isinstance(Template._fields[fname], (Function, Many2One))
+        for fname, direction in order)
+
+    offset = 0
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        values, offset = position
+        if keyset and values is not None and len(values) == len(order):
+            nullable = [fname for fname, direction in order
+                if not Template._fields[fname].required]
+            domain = domain + [keyset_domain(order, values, nullable)]
+            search_offset = 0
+        else:
+            search_offset = offset
+    else:
+        search_offset = 0
+
+    with Transaction().set_context(without_special_price=True), \
+            timed('search'):
+        products = Template.search(domain, search_offset, limit + 1, order)
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        values = None
+        if keyset:
+            values = [getattr(last, fname) for fname, direction in order]
+            if any(v is None for v in values):
+                values = None
+        next_cursor = encode_cursor(values, offset + limit)
+    return products, next_cursor
+
+def menus_version(Model):
+    '''Last write or create date and number of the menus (or categories)'''
+    table = Model.__table__()
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*table.select(
+            Max(Coalesce(table.write_date, table.create_date)),
+            Count(Literal('*'))))
+    return tuple(cursor.fetchone())
+
+
+def get_menu_tree(website):
+    '''Catalog menus of the website (or categories) by slug
+
+    The tree is read in one query per website and language and cached until
+    the menus change (checked with one aggregate query), the timeout or
+    invalidate_catalog_cache('menus').
+    '''
+    Category = tryton.pool.get('product.category')
+    Menu = tryton.pool.get('esale.catalog.menu')
+
+    menu_category = get_menu_category()
+    key = (website.id, Transaction().language, menu_category,
+        menus_version(Category if menu_category else Menu),
+        get_catalog_cache_stamp('menus').version())
+    cache = get_cache('catalog-menus', 64, get_catalog_menu_cache_timeout())
+    tree = cache.get(key)
+    if tree is None:
+        fields_names = ['slug', 'name', 'parent', 'default_sort_by']
+        with Transaction().set_context(active_test=False):
+            if menu_category:
+                # parents may not be published in the website
+                records = Category.search_read([],
+                    fields_names=fields_names + ['esale_active', 'websites'])
+                for record in records:
+                    record['active'] = (record['esale_active']
+                        and website.id in record['websites'])
+            else:
+                records = Menu.search_read([
+                        ('website', '=', website.id),
+                        ], fields_names=fields_names + ['active'])
+        tree = MenuTree(records)
+        cache.set(key, tree)
+    return tree
+
+def published_templates_domain():
+    '''Domain of the templates published in the shop'''
+    return [
+        ('salable', '=', True),
+        ('esale_available', '=', True),
+        ('esale_active', '=', True),
+        ('shops', 'in', [get_shop_id()]),
+        ]
+
+
+def database_now():
+    '''Current timestamp of the database, the clock of write_date'''
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*Select([CurrentTimestamp()]))
+    return cursor.fetchone()[0]
+
+
+def get_membership_index():
+    '''Published templates of the shop by menu
+
+    The index is built with one read of the published templates per shop and
+    language. It is then kept current by reading the templates created or
+    written since the last sync, at most every
+    TRYTON_CATALOG_MEMBERSHIP_SYNC_INTERVAL seconds, each sync reading again
+    the last TRYTON_CATALOG_SYNC_OVERLAP seconds. Deleted templates are
+    dropped by membership_page and invalidate_catalog_cache('products')
+    rebuilds it.
+    '''
+    Template = tryton.pool.get('product.template')
+
+    menus_field = 'categories' if get_menu_category() else 'esale_menus'
+    sort_fields = get_catalog_membership_sort_fields()
+    fields_names = [menus_field] + sort_fields
+    key = (get_shop_id(), Transaction().language, menus_field)
+    version = get_catalog_cache_stamp('products').version()
+
+    with _MEMBERSHIP_LOCK:
+        entry = _MEMBERSHIP_INDEXES.get(key)
+        if entry is None or entry['version'] != version:
+            entry = None
+        elif time.time() - entry['synced'] < \
+                get_catalog_membership_sync_interval():
+            return entry['index']
+        else:
+            since = entry['since']
+            entry['synced'] = time.time()
+
+    next_since = database_now() - datetime.timedelta(
+        seconds=get_catalog_sync_overlap())
+    if entry is None:
+        index = MembershipIndex(sort_fields)
+        with Transaction().set_context(without_special_price=True):
+            records = Template.search_read(published_templates_domain(),
+                fields_names=fields_names)
+        index.update(records, menus_field)
+        with _MEMBERSHIP_LOCK:
+            _MEMBERSHIP_INDEXES[key] = {
+                'index': index,
+                'version': version,
+                'since': next_since,
+                'synced': time.time(),
+                }
+        return index
+
+    # templates created or written since the last sync, unpublished ones
+    # included (write_date is empty on create)
+    entry['since'] = next_since
+    index = entry['index']
+    with Transaction().set_context(active_test=False,
+            without_special_price=True):
+        changed = Template.search(['OR',
+                ('write_date', '>=', since),
+                ('create_date', '>=', since),
+                ])
+        records = Template.search_read(published_templates_domain() + [
+                ('id', 'in', [t.id for t in changed]),
+                ('active', '=', True),
+                ], fields_names=fields_names) if changed else []
+    published = set(r['id'] for r in records)
+    index.remove([t.id for t in changed if t.id not in published])
+    index.update(records, menus_field)
+    return index
+
+
+def membership_page(menu_id, order, offset, limit, filter_ids=None):
+    '''Page of templates of a menu and total from the membership index
+
+    filter_ids restricts the templates to these ids. Return None when the
+    index does not hold the fields of order. Templates of the page deleted
+    since they were read are removed from the index.
+    '''
+    Template = tryton.pool.get('product.template')
+
+    if filter_ids is not None:
+        filter_ids = set(filter_ids)
+    with timed('search'):
+        index = get_membership_index()
+        if not index.sortable(order):
+            return None
+        while True:
+            ids = index.ordered(menu_id, order)
+            if filter_ids is not None:
+                ids = [i for i in ids if i in filter_ids]
+            page_ids = ids[offset:offset+limit]
+            if not page_ids:
+                break
+            # deletions are not seen by the syncs
+            with Transaction().set_context(active_test=False):
+                existing = set(t.id for t in Template.search([
+                            ('id', 'in', page_ids),
+                            ]))
+            deleted = [i for i in page_ids if i not in existing]
+            if not deleted:
+                break
+            index.remove(deleted)
+    with Transaction().set_context(without_special_price=True):
+        products = Template.browse(page_ids)
+    return products, len(ids)
+
+def get_facet_index():
+    '''Published templates of the shop by CATALOG_TEMPLATE_FILTERS values'''
+    Template = tryton.pool.get('product.template')
+
+    menus_field = 'categories' if get_menu_category() else 'esale_menus'
+    fieldnames = list(CATALOG_TEMPLATE_FILTERS) + [menus_field]
+    key = (get_shop_id(), Transaction().language, tuple(fieldnames),
+        get_catalog_cache_stamp('products').version())
+    cache = get_cache('catalog-facets', 8, get_catalog_facet_cache_timeout())
+    index = cache.get(key)
+    if index is None:
+        records = Template.search_read(published_templates_domain(),
+            fields_names=fieldnames)
+        index = FacetIndex(records, fieldnames)
+        cache.set(key, index)
+    return index
+
+
+def catalog_facets(domain_filter, menu_id=None, ids=None):
+    '''Template ids matching the filters and counts by filter value
+
+    Filters are the (field, 'in', values) clauses of domain_filter. The ids
+    are None without filters. Counts are computed among the templates of
+    menu_id and of ids, or of the whole shop.
+    '''
+    index = get_facet_index()
+    universe = None
+    if menu_id is not None:
+        menus_field = 'categories' if get_menu_category() else 'esale_menus'
+        universe = index.bitmap(menus_field, [menu_id])
+    if ids is not None:
+        bitmap = ids_bitmap(ids) & index.universe
+        universe = bitmap if universe is None else universe & bitmap
+    filters = dict((k, v) for k, operator, v in domain_filter)
+    matching, counts = index.search(filters, CATALOG_TEMPLATE_FILTERS,
+        universe)
+    ids = bitmap_ids(matching) if filters else None
+    return ids, counts
+
+def get_keyword_index():
+    '''Published templates of the shop by meta keyword token'''
+    Template = tryton.pool.get('product.template')
+
+    key = (get_shop_id(), Transaction().language,
+        get_catalog_cache_stamp('products').version())
+    cache = get_cache('catalog-keywords', 8,
+        get_catalog_keyword_cache_timeout())
+    index = cache.get(key)
+    if index is None:
+        records = Template.search_read(published_templates_domain(),
+            fields_names=['esale_metakeyword'])
+        index = KeywordIndex(records, 'esale_metakeyword')
+        cache.set(key, index)
+    return index
+
+def prefetch_products(products):
+    '''Prices and default images of a page of templates
+
+    Both computed fields are read for the whole page in a single read, with
+    the same context as the listing search. Return the values by template
+    id, with esale_price and esale_default_images keys.
+    '''
+    Template = tryton.pool.get('product.template')
+
+    if not products:
+        return {}
+    with Transaction().set_context(without_special_price=True), \
+            timed('fields'):
+        values = Template.read([p.id for p in products],
+            ['esale_price', 'esale_default_images'])
+    return dict((v['id'], v) for v in values)
+
 
+def product_payload(product):
+    '''JSON details of a product template'''
     result = {}
     result['name'] = product.name
     result['url'] = '%s%s' % (current_app.config['BASE_URL'], url_for(
@@ -141,8 +1012,433 @@ def product_json(lang, slug):
         if p.code:
             codes.append(p.code)
     result['codes'] = codes
+    return result
+
+
+def catalog_price_version():
+    '''Last change of the price list lines or None without price lists'''
+    try:
+        PriceListLine = tryton.pool.get('product.price_list.line')
+    except KeyError:
+        return None
+    table = PriceListLine.__table__()
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*table.select(
+            Max(Coalesce(table.write_date, table.create_date))))
+    return cursor.fetchone()[0]
+
+
+def variants_versions(template_ids):
+    '''Last write or create date and number of the variants by template id'''
+    Product = tryton.pool.get('product.product')
+
+    if not template_ids:
+        return {}
+    table = Product.__table__()
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*table.select(table.template,
+            Max(Coalesce(table.write_date, table.create_date)),
+            Count(Literal('*')),
+            where=table.template.in_(list(template_ids)),
+            group_by=[table.template]))
+    return dict((row[0], tuple(row[1:])) for row in cursor.fetchall())
+
+
+def product_payload_key(product, price_version, variants_version=None):
+    '''Cache key of the JSON details of a product
+
+    The key changes with the template and variants write_date, the price
+    lists and the products cache stamp, so cached details are never stale.
+    '''
+    return (product.id, g.language, get_shop_id(), product.write_date,
+        variants_version, price_version,
+        get_catalog_cache_stamp('products').version())
+
+
+def cached_product_payload(product, price_version, versions=None):
+    '''JSON details of a product from the product JSON cache
+
+    versions are the variants versions of the products being read, the
+    ones of product are queried without them.
+    '''
+    cache = get_cache('catalog-product-json',
+        get_catalog_product_json_cache_size(),
+        get_catalog_product_json_cache_timeout())
+    if versions is None:
+        versions = variants_versions([product.id])
+    key = product_payload_key(product, price_version,
+        versions.get(product.id))
+    result = cache.get(key)
+    if result is None:
+        with timed('fields'):
+            result = product_payload(product)
+        cache.set(key, result)
+    return result
+
+
+def product_cards(products, website, shop):
+    '''Rendered cards of a page of templates by id
+
+    Cards are rendered with TRYTON_CATALOG_CARD_TEMPLATE and cached by
+    template id, write_date, language, shop, view mode, price lists and the
+    products cache stamp. The page is looked up with one get_many and only
+    the missing cards are prefetched and rendered. Return an empty dict when
+    the cache is disabled and for logged-in users, whose prices may differ.
+    Cards get the website and shop of the listing templates, but must not
+    render session data (e.g. CSRF tokens).
+    '''
+    card_template = get_catalog_card_template()
+    if not card_template or not products or session.get('user'):
+        return {}
+
+    view = session.get('catalog_view') or 'grid'
+    price_version = catalog_price_version()
+    version = get_catalog_cache_stamp('products').version()
+    keys = dict((p.id, (p.id, p.write_date, g.language, get_shop_id(), view,
+                price_version, version)) for p in products)
+    cache = get_cache('catalog-cards', get_catalog_card_cache_size(),
+        get_catalog_card_cache_timeout())
+    cached = cache.get_many(keys.values())
+
+    cards = {}
+    missing = []
+    for product in products:
+        card = cached.get(keys[product.id])
+        if card is None:
+            missing.append(product)
+        else:
+            cards[product.id] = card
+    if missing:
+        prefetch = prefetch_products(missing)
+        for product in missing:
+            card = Markup(render_template(card_template, product=product,
+                    prefetch=prefetch, view=view, website=website,
+                    shop=shop))
+            cache.set(keys[product.id], card)
+            cards[product.id] = card
+    return cards
+
+@tryton.transaction()
+def _warm_product_json(limit):
+    Template = tryton.pool.get('product.template')
+
+    with Transaction().set_context(language=g.language,
+            without_special_price=True):
+        products = Template.search(published_templates_domain(),
+            limit=limit, order=[('esale_sequence', 'ASC'), ('id', 'ASC')])
+        price_version = catalog_price_version()
+        versions = variants_versions([p.id for p in products])
+        for product in products:
+            cached_product_payload(product, price_version, versions)
+    return len(products)
+
+
+def warm_product_json(app, lang, limit=100):
+    '''Fill the product JSON cache of this process with limit products
+
+    Products are taken in esale_sequence order. Caches are per process, so
+    call it from each worker (e.g. a post fork hook of the WSGI server).
+    '''
+    with app.test_request_context('/%s/' % lang):
+        g.language = lang
+        return _warm_product_json(limit)
+
+@tryton.transaction()
+def _export_chunk(last_id, size):
+    Template = tryton.pool.get('product.template')
+
+    with Transaction().set_context(language=g.language,
+            without_special_price=True):
+        products = Template.search(published_templates_domain() + [
+                ('id', '>', last_id),
+                ], limit=size, order=[('id', 'ASC')])
+        return [(p.id, p.write_date or p.create_date, product_payload(p))
+            for p in products]
+
+
+def iter_catalog_products(last_id=0, limit=None):
+    '''Yield (id, last modification, details) of the published templates
+
+    Templates after last_id are read in id order by chunks of
+    TRYTON_CATALOG_EXPORT_CHUNK_SIZE, each chunk in its own transaction, so
+    only one chunk is held in memory. At most limit templates are yielded.
+    '''
+    size = get_catalog_export_chunk_size()
+    while True:
+        if limit is not None:
+            size = min(size, limit)
+            if not size:
+                break
+        chunk = _export_chunk(last_id, size)
+        for row in chunk:
+            yield row
+        if len(chunk) < size:
+            break
+        last_id = chunk[-1][0]
+        if limit is not None:
+            limit -= len(chunk)
+
+
+@tryton.transaction()
+def _sitemap_pages(size):
+    Template = tryton.pool.get('product.template')
+
+    return (Template.search(published_templates_domain(), count=True)
+        - 1) // size + 1
+
+
+@tryton.transaction()
+def _sitemap_page_start(page, size):
+    '''Id before the first template of page, None after the last page'''
+    Template = tryton.pool.get('product.template')
+
+    if page == 1:
+        return 0
+    templates = Template.search(published_templates_domain(),
+        offset=(page - 1) * size, limit=1, order=[('id', 'ASC')])
+    return templates[0].id - 1 if templates else None
+
+
+def export_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row[2], default=str) + '\n'
+
+
+CATALOG_EXPORT_CSV_FIELDS = ['name', 'url', 'price', 'code', 'codes',
+    'shortdescription']
+
+
+def export_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CATALOG_EXPORT_CSV_FIELDS)
+    for row in rows:
+        result = dict(row[2], codes=' '.join(row[2]['codes']))
+        values = [result.get(k) for k in CATALOG_EXPORT_CSV_FIELDS]
+        writer.writerow(['' if v is None else v for v in values])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+    yield buf.getvalue()
+
+
+def export_sitemap(rows):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    for id_, last_modified, result in rows:
+        url = '<url><loc>%s</loc>' % escape(result['url'])
+        if last_modified:
+            url += '<lastmod>%s</lastmod>' % last_modified.strftime('%Y-%m-%d')
+        yield url + '</url>\n'
+    yield '</urlset>\n'
+
+
+def export_sitemap_index(urls):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    for url in urls:
+        yield '<sitemap><loc>%s</loc></sitemap>\n' % escape(url)
+    yield '</sitemapindex>\n'
+
+
+CATALOG_EXPORT_FORMATS = {
+    'jsonl': (export_jsonl, 'application/x-ndjson'),
+    'csv': (export_csv, 'text/csv'),
+    'xml': (export_sitemap, 'application/xml'),
+    }
+
+
+def catalog_export_data(fmt, page=None):
+    '''Chunks of the catalog export in fmt
+
+    A sitemap holds at most TRYTON_CATALOG_SITEMAP_SIZE urls: page selects
+    one of them and without page, a catalog that does not fit in one
+    sitemap is exported as the sitemap index of its pages.
+    '''
+    exporter = CATALOG_EXPORT_FORMATS[fmt][0]
+    if fmt != 'xml':
+        return exporter(iter_catalog_products())
+
+    size = get_catalog_sitemap_size()
+    if page is None:
+        pages = _sitemap_pages(size)
+        if pages > 1:
+            return export_sitemap_index(url_for('catalog.export',
+                        lang=g.language, fmt=fmt, page=p, _external=True)
+                for p in range(1, pages + 1))
+        page = 1
+    last_id = _sitemap_page_start(page, size) if page > 0 else None
+    if last_id is None:
+        abort(404)
+    return exporter(iter_catalog_products(last_id, size))
+
+
+def export_catalog(app, lang, fmt, output, page=None):
+    '''Write the published templates of the shop to output in fmt'''
+    with app.test_request_context('/%s/' % lang):
+        g.language = lang
+        for data in catalog_export_data(fmt, page):
+            output.write(data)
+
+def render_template(template_name_or_list, **context):
+    '''Render a template, timed as the render phase'''
+    with timed('render'):
+        return _render_template(template_name_or_list, **context)
+
+@catalog.before_request
+def start_timings():
+    if get_catalog_timing():
+        g.catalog_timings = RequestTimings()
+
+@catalog.after_request
+def send_timings(response):
+    '''Server-Timing header and process histograms of a timed request'''
+    timings = g.get('catalog_timings')
+    if timings is not None:
+        metrics = timings.metrics()
+        response.headers['Server-Timing'] = timings.header(metrics)
+        record_timings(request.endpoint, metrics, get_catalog_timing_hook())
+    return response
+
+@catalog.route("/timings", endpoint="timings")
+def timings(lang):
+    '''Timing histograms and cache counters of this process'''
+    if not get_catalog_timing_endpoint():
+        abort(404)
+    return jsonify({
+        'timings': timings_stats(),
+        'caches': caches_stats(),
+        })
+
+@catalog.route("/export.<fmt>", endpoint="export")
+def export(lang, fmt):
+    '''Catalog export
+
+    Stream the published templates of the shop as JSON Lines (jsonl), CSV
+    (csv) or an XML sitemap (xml), split in pages selected by the page
+    argument past TRYTON_CATALOG_SITEMAP_SIZE urls.
+    '''
+    if fmt not in CATALOG_EXPORT_FORMATS:
+        abort(404)
+    mimetype = CATALOG_EXPORT_FORMATS[fmt][1]
+    data = catalog_export_data(fmt, request.args.get('page', type=int))
+    return Response(stream_with_context(data), mimetype=mimetype)
+
+@catalog.route("/json/<slug>", endpoint="product_json")
+@tryton.transaction()
+def product_json(lang, slug):
+    '''Product JSON Details
+
+    slug param is a product slug or a product code
+    '''
+    product = resolve_product(slug)
+    if not product:
+        abort(404)
+
+    return jsonify(cached_product_payload(product, catalog_price_version()))
+
+@catalog.route("/json/", methods=["GET", "POST"], endpoint="products_json")
+@tryton.transaction()
+def products_json(lang):
+    '''Products JSON Details
+
+    slugs are product slugs or product codes, as repeated slug arguments or
+    as a slugs list in a JSON body. Return the details by slug, null when
+    the slug is not found.
+    '''
+    Template = tryton.pool.get('product.template')
+    Product = tryton.pool.get('product.product')
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        abort(400)
+    slugs = data.get('slugs') or request.args.getlist('slug')
+    if not isinstance(slugs, list):
+        abort(400)
+    slugs = ['%s' % slug for slug in slugs]
+    if len(slugs) > get_catalog_product_json_batch_limit():
+        abort(400)
+    if not slugs:
+        return jsonify({})
+
+    template_ids = {}
+    with Transaction().set_context(without_special_price=True):
+        with timed('search'):
+            templates = Template.search([
+                    ('salable', '=', True),
+                    ('esale_available', '=', True),
+                    ('esale_slug', 'in', slugs),
+                    ('esale_active', '=', True),
+                    ('shops', 'in', [get_shop_id()]),
+                    ])
+        for product in templates:
+            template_ids.setdefault(product.esale_slug, product.id)
+
+        # search products by code
+        codes = [slug for slug in slugs if slug not in template_ids]
+        if codes:
+            with timed('search'):
+                variants = Product.search([
+                        ('template.esale_available', '=', True),
+                        ('code', 'in', codes),
+                        ('template.esale_active', '=', True),
+                        ('template.shops', 'in', [get_shop_id()]),
+                        ])
+            for product in variants:
+                template_ids.setdefault(product.code, product.template.id)
+
+        # browsed together, the computed fields are read for all of them
+        ids = list(set(template_ids.values()))
+        products = dict((p.id, p) for p in Template.browse(ids))
+        price_version = catalog_price_version()
+        versions = variants_versions(ids)
+        result = {}
+        for slug in slugs:
+            if slug in template_ids:
+                result[slug] = cached_product_payload(
+                    products[template_ids[slug]], price_version, versions)
+            else:
+                result[slug] = None
     return jsonify(result)
 
+@catalog.route("/search/suggest", methods=["GET"], endpoint="suggest")
+def suggest(lang):
+    '''Search suggestions
+
+    Answered from a prefix index of product names and codes built from the
+    catalog index, without a Tryton transaction.
+    '''
+    schema_dir = get_catalog_schema_dir(lang)
+    if not schema_dir:
+        abort(404)
+
+    prefix_index = get_prefix_index(schema_dir, get_catalog_suggest_fields())
+    if prefix_index is None:
+        abort(404)
+
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify([])
+
+    max_limit = get_catalog_suggest_limit()
+    try:
+        limit = min(int(request.args.get('limit', max_limit)), max_limit)
+    except ValueError:
+        limit = max_limit
+
+    results = []
+    for id_ in prefix_index.lookup(q, limit):
+        doc = prefix_index.names[id_]
+        result = {
+            'id': id_,
+            'name': doc['name'],
+            }
+        if doc['slug']:
+            result['url'] = url_for('.product_'+g.language, lang=g.language,
+                slug=doc['slug'])
+        results.append(result)
+    return jsonify(results)
+
 @catalog.route("/search/", methods=["GET"], endpoint="search")
 @tryton.transaction()
 def search(lang):
@@ -153,15 +1449,13 @@ def search(lang):
     Category = tryton.pool.get('product.category')
     Shop = tryton.pool.get('sale.shop')
 
-    WHOOSH_CATALOG_DIR = current_app.config.get('WHOOSH_CATALOG_DIR')
-    if not WHOOSH_CATALOG_DIR:
+    schema_dir = get_catalog_schema_dir(lang)
+    if not schema_dir:
         abort(404)
 
-    db_name = current_app.config.get('TRYTON_DATABASE')
-    schema_dir = os.path.join(tryton_config.get('database', 'path'),
-        db_name, 'whoosh', WHOOSH_CATALOG_DIR, lang)
-
-    if not os.path.exists(schema_dir):
+    # opened indexes are kept per process (see search_index)
+    ix = get_index(schema_dir)
+    if ix is None:
         abort(404)
 
     website = Website(get_galatea_website())
@@ -180,11 +1474,12 @@ def search(lang):
         return render_template('catalog-search.html',
                 website=website,
                 products=[],
+                cards={},
                 breadcrumbs=breadcrumbs,
                 pagination=None,
                 q=None,
                 )
-    session['q'] = q
+    set_session('q', q)
 
     # Get products from schema results
     try:
@@ -196,7 +1491,7 @@ def search(lang):
     if request.args.get('limit'):
         try:
             limit = int(request.args.get('limit'))
-            session['catalog_limit'] = limit
+            set_session('catalog_limit', limit, get_limit())
         except:
             limit = get_limit()
     else:
@@ -207,36 +1502,34 @@ def search(lang):
         view = 'grid'
         if request.args.get('view') == 'list':
             view = 'list'
-        session['catalog_view'] = view
+        set_session('catalog_view', view)
 
-    # Search
-    ix = index.open_dir(schema_dir)
-    query = q.replace('+', ' AND ').replace('-', ' NOT ')
-    if get_catalog_search_add_wildcard():
-        phrases = []
-        for phrase in query.split('"')[1::2]:
-            phrases.append('"' + phrase + '"')
-        words = []
-        for word in ' '.join(query.split('"')[0::2]).split():
-            if word and word not in ['AND', 'NOT', 'OR']:
-                word = '("' + word + '" OR *' + word + '*)'
-            words.append(word)
-        query = " ".join(phrases + words)
-    query = MultifieldParser(get_catalog_schema_parse_fields(), ix.schema).parse(query)
-
-    with ix.searcher() as s:
-        all_results = s.search_page(query, 1, pagelen=get_whoosh_max_limit())
-        total = all_results.scored_length()
-        results = s.search_page(query, page, pagelen=limit) # by pagination
-        res = [result.get('id') for result in results]
+    # order: relevance or by sortable index columns keep the order of the
+    # index results, other orders sort the page of results in the database
+    order = search_ordered()
+    sortedby = search_sortedby(ix.schema, order) if order else None
 
-    domain = [('id', 'in', res)]
+    # Search
+    ids = search_catalog_ids(schema_dir, q, sortedby)
+    total = len(ids)
+    offset = (page-1)*limit
+    res = ids[offset:offset+limit]
 
-    with Transaction().set_context(without_special_price=True):
-        products = Template.search(domain, order=catalog_ordered())
+    with Transaction().set_context(without_special_price=True), \
+            timed('search'):
+        if order is None or sortedby:
+            products = Template.browse(res)
+        else:
+            products = Template.search([('id', 'in', res)], order=order)
 
     pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
 
+    shop = Shop(get_shop_id())
+    cards = {}
+    if request.args.get('format') != 'json':
+        cards = product_cards(products, website, shop)
+    prefetch = prefetch_products([p for p in products if p.id not in cards])
+
     if request.args.get('format') == 'json':
         results = []
         for product in products:
@@ -245,10 +1538,11 @@ def search(lang):
                 'url': url_for('.product_'+g.language, lang=g.language,
                     slug=product.esale_slug)
             }
-            if product.esale_default_images['small']:
+            images = prefetch[product.id]['esale_default_images']
+            if images['small']:
                 result['image'] = thumbnail(
-                    product.esale_default_images['small']['digest'],
-                    product.esale_default_images['small']['name'],
+                    images['small']['digest'],
+                    images['small']['name'],
                     '100x100',
                     )
             results.append(result)
@@ -257,9 +1551,11 @@ def search(lang):
         return render_template('catalog-search.html',
             website=website,
             products=products,
+            prefetch=prefetch,
+            cards=cards,
             pagination=pagination,
             breadcrumbs=breadcrumbs,
-            shop=Shop(get_shop_id()),
+            shop=shop,
             q=q,
             )
 
@@ -272,6 +1568,7 @@ def search(lang):
 @catalog.route("/product/<slug>", endpoint="product_pl")
 @catalog.route("/product/<slug>", endpoint="product_pt")
 @tryton.transaction()
+@catalog_response_cached('catalog-product')
 def product(lang, slug):
     '''Product Details
 
@@ -279,8 +1576,6 @@ def product(lang, slug):
     '''
     Website = tryton.pool.get('galatea.website')
     User = tryton.pool.get('galatea.user')
-    Template = tryton.pool.get('product.template')
-    Product = tryton.pool.get('product.product')
     Shop = tryton.pool.get('sale.shop')
     template = request.args.get('template', None)
 
@@ -295,35 +1590,11 @@ def product(lang, slug):
 
     website = Website(get_galatea_website())
 
-    with Transaction().set_context(without_special_price=True):
-        products = Template.search([
-            ('salable', '=', True),
-            ('esale_available', '=', True),
-            ('esale_slug', '=', slug),
-            ('esale_active', '=', True),
-            ('shops', 'in', [get_shop_id()]),
-            ], limit=1)
-
-    product = None
-    if products:
-        product, = products
-
-    if not product:
-        # search product by code
-        with Transaction().set_context(without_special_price=True):
-            products = Product.search([
-                ('template.esale_available', '=', True),
-                ('code', '=', slug),
-                ('template.esale_active', '=', True),
-                ('template.shops', 'in', [get_shop_id()]),
-                ], limit=1)
-        if products:
-            product = products[0].template
-
+    product = resolve_product(slug)
     if not product:
         abort(404)
 
-    session['next'] = url_for('.product_'+g.language, lang=g.language, slug=product.esale_slug)
+    set_session_next(url_for('.product_'+g.language, lang=g.language, slug=product.esale_slug))
 
     #breadcumbs
     breadcrumbs = [{
@@ -349,8 +1620,6 @@ def product(lang, slug):
 def key(lang, key):
     '''Products by Key'''
     Website = tryton.pool.get('galatea.website')
-    Template = tryton.pool.get('product.template')
-    Product = tryton.pool.get('product.product')
     Shop = tryton.pool.get('sale.shop')
 
     website = Website(get_galatea_website())
@@ -359,7 +1628,7 @@ def key(lang, key):
     if request.args.get('limit'):
         try:
             limit = int(request.args.get('limit'))
-            session['catalog_limit'] = limit
+            set_session('catalog_limit', limit, get_limit())
         except:
             limit = get_limit()
     else:
@@ -370,7 +1639,7 @@ def key(lang, key):
         view = 'grid'
         if request.args.get('view') == 'list':
             view = 'list'
-        session['catalog_view'] = view
+        set_session('catalog_view', view)
 
     try:
         page = int(request.args.get('page', 1))
@@ -388,37 +1657,68 @@ def key(lang, key):
         for k in list(domain_filter_keys):
             domain_filter.append((k, 'in', request.form.getlist(k)))
 
-    session['catalog_filter'] = domain_filter
+    set_session('catalog_filter', domain_filter, [])
+
+    # keyword index matches whole keywords, unknown ones fall back to ilike
+    keyword_ids = None
+    if get_catalog_keyword_index():
+        keyword_ids = get_keyword_index().lookup(key)
+    if keyword_ids is not None:
+        keyword_domain = ('id', 'in', keyword_ids)
+    else:
+        keyword_domain = ('esale_metakeyword', 'ilike', '%'+key+'%')
 
     domain = [
         ('salable', '=', True),
         ('esale_available', '=', True),
         ('esale_active', '=', True),
         ('shops', 'in', [get_shop_id()]),
-        ('esale_metakeyword', 'ilike', '%'+key+'%'),
-        ] + domain_filter
+        keyword_domain,
+        ]
+    # templates of the keyword (and query) when known from the indexes
+    universe = keyword_ids
 
     # Search
     if request.args.get('q'):
         qstr = request.args.get('q')
-        q = '%' + qstr + '%'
-        domain.append(
-            ('rec_name', 'ilike', q),
-            )
-        session.q = qstr
+        q_ids = catalog_query_ids(lang, qstr)
+        if q_ids is not None:
+            domain.append(('id', 'in', list(q_ids)))
+            if universe is not None:
+                q_ids = set(q_ids)
+                universe = [i for i in universe if i in q_ids]
+        else:
+            q = '%' + qstr + '%'
+            domain.append(
+                ('rec_name', 'ilike', q),
+                )
+            universe = None
         flash(_('Search results for "{qstr}"').format(qstr=qstr))
-    else:
-        session.q = None
-
-    total = Template.search_count(domain)
-    offset = (page-1)*limit
 
-    with Transaction().set_context(without_special_price=True):
-        products = Template.search(domain, offset, limit, order=catalog_ordered())
-
-    pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
+    # facet engine resolves the filters to template ids, counted among the
+    # templates of the keyword
+    facets = facet_ids = None
+    if get_catalog_facets():
+        if universe is None:
+            universe = search_template_ids(domain)
+        facet_ids, facets = catalog_facets(domain_filter, ids=universe)
+        if facet_ids is not None:
+            domain_filter = [('id', 'in', facet_ids)]
+    domain += domain_filter
+
+    # cursor replaces page in keyset pagination
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        products, next_cursor = search_templates_cursor(domain, cursor,
+            limit, catalog_ordered())
+        pagination = None
+    else:
+        offset = (page-1)*limit
+        products, total = search_templates(domain, offset, limit, catalog_ordered())
+        next_cursor = None
+        pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
 
-    session['next'] = url_for('.key', lang=g.language, key=key)
+    set_session_next(url_for('.key', lang=g.language, key=key))
 
     #breadcumbs
     breadcrumbs = [{
@@ -429,13 +1729,22 @@ def key(lang, key):
         'name': key,
         }, ]
 
+    shop = Shop(get_shop_id())
+    cards = product_cards(products, website, shop)
+    prefetch = prefetch_products([p for p in products if p.id not in cards])
+
     return render_template('catalog-key.html',
             website=website,
             pagination=pagination,
+            next_cursor=next_cursor,
+            facets=facets,
             products=products,
+            prefetch=prefetch,
+            cards=cards,
             breadcrumbs=breadcrumbs,
             key=key,
-            shop=Shop(get_shop_id())
+            q=request.args.get('q'),
+            shop=shop
             )
 
 @catalog.route("/category/<slug>", methods=["GET", "POST"], endpoint="category_product_en")
@@ -447,12 +1756,11 @@ def key(lang, key):
 @catalog.route("/category/<slug>", methods=["GET", "POST"], endpoint="category_product_pl")
 @catalog.route("/category/<slug>", methods=["GET", "POST"], endpoint="category_product_pt")
 @tryton.transaction()
+@catalog_response_cached('catalog-category-product')
 def category_products(lang, slug):
     '''Category Products'''
     Website = tryton.pool.get('galatea.website')
     User = tryton.pool.get('galatea.user')
-    Template = tryton.pool.get('product.template')
-    Product = tryton.pool.get('product.product')
     Category = tryton.pool.get('product.category')
     Menu = tryton.pool.get('esale.catalog.menu')
     Shop = tryton.pool.get('sale.shop')
@@ -460,27 +1768,20 @@ def category_products(lang, slug):
     website = Website(get_galatea_website())
     user_id = session.get('user')
 
+    menu_tree = get_menu_tree(website)
+    node = menu_tree.get(slug)
+    if not node:
+        abort(404)
     if get_menu_category():
-        menus = Category.search([
-            ('slug', '=', slug),
-            ('esale_active', '=', True),
-            ('websites', 'in', [website]),
-            ], limit=1)
+        menu = Category(node['id'])
     else:
-        menus = Menu.search([
-            ('slug', '=', slug),
-            ('active', '=', True),
-            ('website', '=', website),
-            ], limit=1)
-    if not menus:
-        abort(404)
-    menu, = menus
+        menu = Menu(node['id'])
 
     # limit
     if request.args.get('limit'):
         try:
             limit = int(request.args.get('limit'))
-            session['catalog_limit'] = limit
+            set_session('catalog_limit', limit, get_limit())
         except:
             limit = get_limit()
     else:
@@ -491,14 +1792,14 @@ def category_products(lang, slug):
         view = 'grid'
         if request.args.get('view') == 'list':
             view = 'list'
-        session['catalog_view'] = view
+        set_session('catalog_view', view)
 
     # order
-    if menu.default_sort_by == 'position':
+    if node['default_sort_by'] == 'position':
         order = 'esale_sequence'
-    elif menu.default_sort_by == 'price':
+    elif node['default_sort_by'] == 'price':
         order = get_catalog_order_price()
-    elif menu.default_sort_by == 'date':
+    elif node['default_sort_by'] == 'date':
         order = 'create_date'
     else:
         order = 'name'
@@ -520,7 +1821,14 @@ def category_products(lang, slug):
         for k in list(domain_filter_keys):
             domain_filter.append((k, 'in', request.form.getlist(k)))
 
-    session['catalog_filter'] = domain_filter
+    set_session('catalog_filter', domain_filter, [])
+
+    # facet engine resolves the filters to template ids
+    facets = facet_ids = None
+    if get_catalog_facets():
+        facet_ids, facets = catalog_facets(domain_filter, node['id'])
+        if facet_ids is not None:
+            domain_filter = [('id', 'in', facet_ids)]
 
     domain = [
         ('salable', '=', True),
@@ -529,9 +1837,13 @@ def category_products(lang, slug):
         ('shops', 'in', [get_shop_id()]),
         ] + domain_filter
     if get_menu_category():
-        domain.append(('categories', 'in', [menu.id]))
+        domain.append(('categories', 'in', [node['id']]))
     else:
-        domain.append(('esale_menus', 'in', [menu.id]))
+        domain.append(('esale_menus', 'in', [node['id']]))
+
+    # membership index only holds the shop and menu conditions
+    membership = get_catalog_membership_index() and (not domain_filter
+        or facet_ids is not None)
 
     if user_id:
         user = User(user_id)
@@ -539,16 +1851,27 @@ def category_products(lang, slug):
             catalog_product_domain = User.catalog_product_domain(user, session, website)
             if catalog_product_domain:
                 domain += catalog_product_domain
-
-    total = Template.search_count(domain)
-    offset = (page-1)*limit
-
-    with Transaction().set_context(without_special_price=True):
-        products = Template.search(domain, offset, limit, order)
-
-    pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
-
-    session['next'] = url_for('.catalog', lang=g.language)
+                membership = False
+
+    # cursor replaces page in keyset pagination
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        products, next_cursor = search_templates_cursor(domain, cursor,
+            limit, order)
+        pagination = None
+    else:
+        offset = (page-1)*limit
+        result = None
+        if membership:
+            result = membership_page(node['id'], order, offset, limit,
+                facet_ids)
+        if result is None:
+            result = search_templates(domain, offset, limit, order)
+        products, total = result
+        next_cursor = None
+        pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
+
+    set_session_next(url_for('.catalog', lang=g.language))
 
     #breadcumbs
     breadcrumbs = []
@@ -557,12 +1880,7 @@ def category_products(lang, slug):
         'name': _('Catalog'),
         })
 
-    def breadcumb_category(menu, categories):
-        if menu.parent:
-            categories.append(menu.parent)
-            breadcumb_category(menu.parent, categories)
-        return categories
-    categories = breadcumb_category(menu, [])
+    categories = menu_tree.parents(node)
     if categories:
         categories.pop()
         categories.reverse()
@@ -570,23 +1888,31 @@ def category_products(lang, slug):
     for category in categories:
         breadcrumbs.append({
             'slug': url_for('.category_product_'+g.language,
-                lang=g.language, slug=category.slug),
-            'name': category.name,
+                lang=g.language, slug=category['slug']),
+            'name': category['name'],
             })
 
     breadcrumbs.append({
         'slug': url_for('.category_product_'+g.language,
-            lang=g.language, slug=menu.slug),
-        'name': menu.name,
+            lang=g.language, slug=node['slug']),
+        'name': node['name'],
         })
 
+    shop = Shop(get_shop_id())
+    cards = product_cards(products, website, shop)
+    prefetch = prefetch_products([p for p in products if p.id not in cards])
+
     return render_template('catalog-category-product.html',
             website=website,
             menu=menu,
             pagination=pagination,
+            next_cursor=next_cursor,
+            facets=facets,
             products=products,
+            prefetch=prefetch,
+            cards=cards,
             breadcrumbs=breadcrumbs,
-            shop=Shop(get_shop_id())
+            shop=shop
             )
 
 @catalog.route("/category/", endpoint="category_en")
@@ -598,6 +1924,7 @@ def category_products(lang, slug):
 @catalog.route("/category/", endpoint="category_pl")
 @catalog.route("/category/", endpoint="category_pt")
 @tryton.transaction()
+@catalog_response_cached('catalog-category')
 def category(lang):
     '''All category'''
     Website = tryton.pool.get('galatea.website')
@@ -621,11 +1948,11 @@ def category(lang):
 
 @catalog.route("/", methods=["GET", "POST"], endpoint="catalog")
 @tryton.transaction()
+@catalog_response_cached('catalog-all')
 def catalog_all(lang):
     '''All catalog products'''
     Website = tryton.pool.get('galatea.website')
     User = tryton.pool.get('galatea.user')
-    Template = tryton.pool.get('product.template')
     Category = tryton.pool.get('product.category')
     Shop = tryton.pool.get('sale.shop')
 
@@ -636,7 +1963,7 @@ def catalog_all(lang):
     if request.args.get('limit'):
         try:
             limit = int(request.args.get('limit'))
-            session['catalog_limit'] = limit
+            set_session('catalog_limit', limit, get_limit())
         except:
             limit = get_limit()
     else:
@@ -647,7 +1974,7 @@ def catalog_all(lang):
         view = 'grid'
         if request.args.get('view') == 'list':
             view = 'list'
-        session['catalog_view'] = view
+        set_session('catalog_view', view)
 
     try:
         page = int(request.args.get('page', 1))
@@ -665,14 +1992,14 @@ def catalog_all(lang):
         for k in list(domain_filter_keys):
             domain_filter.append((k, 'in', request.form.getlist(k)))
 
-    session['catalog_filter'] = domain_filter
+    set_session('catalog_filter', domain_filter, [])
 
     domain = [
         ('salable', '=', True),
         ('esale_available', '=', True),
         ('esale_active', '=', True),
         ('shops', 'in', [get_shop_id()]),
-        ] + domain_filter
+        ]
 
     if user_id:
         user = User(user_id)
@@ -684,28 +2011,48 @@ def catalog_all(lang):
     # Search
     if request.args.get('q'):
         qstr = request.args.get('q')
-        session.q = qstr
-        phrases = qstr.split('"')[1::2]
-        for phrase in phrases:
-            domain.append(
-                ('rec_name', 'ilike', '%{}%'.format(phrase)))
-        words = ' '.join(qstr.split('"')[0::2]).split()
-        for word in words:
-            domain.append(
-                ('rec_name', 'ilike', '%{}%'.format(word)))
+        q_ids = catalog_query_ids(lang, qstr)
+        if q_ids is not None:
+            domain.append(('id', 'in', list(q_ids)))
+            universe = list(q_ids)
+        else:
+            phrases = qstr.split('"')[1::2]
+            for phrase in phrases:
+                domain.append(
+                    ('rec_name', 'ilike', '%{}%'.format(phrase)))
+            words = ' '.join(qstr.split('"')[0::2]).split()
+            for word in words:
+                domain.append(
+                    ('rec_name', 'ilike', '%{}%'.format(word)))
+            universe = None
         flash(_('Search results for "{qstr}"').format(qstr=qstr))
-    else:
-        session.q = None
-
-    total = Template.search_count(domain)
-    offset = (page-1)*limit
-
-    with Transaction().set_context(without_special_price=True):
-        products = Template.search(domain, offset, limit, order=catalog_ordered())
 
-    pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
+    # facet engine resolves the filters to template ids, counted among the
+    # templates of the query or of the whole shop
+    facets = facet_ids = None
+    if get_catalog_facets():
+        if not request.args.get('q'):
+            universe = None
+        elif universe is None:
+            universe = search_template_ids(domain)
+        facet_ids, facets = catalog_facets(domain_filter, ids=universe)
+        if facet_ids is not None:
+            domain_filter = [('id', 'in', facet_ids)]
+    domain += domain_filter
+
+    # cursor replaces page in keyset pagination
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        products, next_cursor = search_templates_cursor(domain, cursor,
+            limit, catalog_ordered())
+        pagination = None
+    else:
+        offset = (page-1)*limit
+        products, total = search_templates(domain, offset, limit, catalog_ordered())
+        next_cursor = None
+        pagination = Pagination(page=page, total=total, per_page=limit, display_msg=DISPLAY_MSG, bs_version='3')
 
-    session['next'] = url_for('.catalog', lang=g.language)
+    set_session_next(url_for('.catalog', lang=g.language))
 
     #breadcumbs
     breadcrumbs = [{
@@ -713,10 +2060,43 @@ def catalog_all(lang):
         'name': _('Catalog'),
         }]
 
+    shop = Shop(get_shop_id())
+    cards = product_cards(products, website, shop)
+    prefetch = prefetch_products([p for p in products if p.id not in cards])
+
     return render_template('catalog.html',
             website=website,
             pagination=pagination,
+            next_cursor=next_cursor,
+            facets=facets,
             products=products,
+            prefetch=prefetch,
+            cards=cards,
             breadcrumbs=breadcrumbs,
-            shop=Shop(get_shop_id())
+            q=request.args.get('q'),
+            shop=shop
             )
+
+if hasattr(catalog, 'cli'):
+    import click
+
+    @catalog.cli.command('export')
+    @click.argument('lang')
+    @click.option('--format', 'fmt', default='jsonl',
+        type=click.Choice(sorted(CATALOG_EXPORT_FORMATS)))
+    @click.option('--output', type=click.File('w'), default='-')
+    def export_command(lang, fmt, output):
+        '''Export the published catalog products'''
+        export_catalog(current_app, lang, fmt, output)
+
+    @catalog.cli.command('index')
+    @click.argument('langs', nargs=-1, required=True)
+    @click.option('--full', is_flag=True,
+        help='Rebuild the whole index instead of the changes.')
+    def index_command(langs, full):
+        '''Index the catalog products changed since the last run'''
+        from .indexer import index_catalog
+        for lang, exitcode in sorted(index_catalog(
+                    current_app._get_current_object(), langs, full).items()):
+            if exitcode:
+                raise click.ClickException('Indexing %s failed' % lang)
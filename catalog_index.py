@@ -0,0 +1,283 @@
+'''In-memory catalog structures built from bulk reads of Tryton records'''
+from array import array
+from bisect import bisect_left
+from threading import Lock
+import binascii
+
+
+class MenuTree(object):
+    '''Catalog menus (or categories) of a website by id and slug
+
+    Nodes are the dicts read from the menu model with at least id, slug,
+    name and parent. Only the nodes passing the active flag are reachable by
+    slug, all of them are kept for the parent chains.
+    '''
+
+    def __init__(self, records):
+        self.nodes = {}
+        self.slugs = {}
+        for record in records:
+            self.nodes[record['id']] = record
+            if record.get('slug') and record.get('active', True):
+                self.slugs.setdefault(record['slug'], record)
+
+    def get(self, slug):
+        return self.slugs.get(slug)
+
+    def parents(self, node):
+        '''Return the ancestors of node, the nearest first'''
+        parents = []
+        seen = set([node['id']])
+        parent = self.nodes.get(node.get('parent'))
+        while parent is not None and parent['id'] not in seen:
+            parents.append(parent)
+            seen.add(parent['id'])
+            parent = self.nodes.get(parent.get('parent'))
+        return parents
+
+
+def _sort_value(value):
+    # strings are compared case insensitively like the database collations
+    if hasattr(value, 'lower'):
+        value = value.lower()
+    return (value is None, value)
+
+
+class MembershipIndex(object):
+    '''Published templates of a shop by menu, with their sort keys
+
+    members maps each menu id to the sorted array of its template ids and
+    keys maps each template id to its values of sort_fields, so listing
+    pages are ordered and sliced in memory. Templates are added, moved or
+    removed with update and remove.
+    '''
+
+    def __init__(self, sort_fields):
+        self.sort_fields = tuple(sort_fields)
+        self.members = {}
+        self.keys = {}
+        self.menus = {}
+        self._ordered = {}
+        self._lock = Lock()
+
+    def update(self, records, menus_field):
+        '''Add or replace templates from records read with their menus'''
+        with self._lock:
+            for record in records:
+                self._remove(record['id'])
+                menus = tuple(record[menus_field])
+                self.menus[record['id']] = menus
+                self.keys[record['id']] = tuple(
+                    _sort_value(record[fname]) for fname in self.sort_fields)
+                for menu_id in menus:
+                    ids = self.members.setdefault(menu_id, array('l'))
+                    ids.insert(bisect_left(ids, record['id']), record['id'])
+            self._ordered.clear()
+
+    def remove(self, ids):
+        with self._lock:
+            for id_ in ids:
+                self._remove(id_)
+            self._ordered.clear()
+
+    def _remove(self, id_):
+        for menu_id in self.menus.pop(id_, ()):
+            ids = self.members[menu_id]
+            i = bisect_left(ids, id_)
+            if i < len(ids) and ids[i] == id_:
+                del ids[i]
+        self.keys.pop(id_, None)
+
+    def sortable(self, order):
+        return all(fname in self.sort_fields or fname == 'id'
+            for fname, direction in order)
+
+    def ordered(self, menu_id, order):
+        '''Return the template ids of menu_id sorted by order'''
+        key = (menu_id, tuple(order))
+        ids = self._ordered.get(key)
+        if ids is not None:
+            return ids
+        with self._lock:
+            ids = list(self.members.get(menu_id, ()))
+            # sort by the last key first, sorts are stable
+            for fname, direction in reversed(order):
+                if fname == 'id':
+                    keyfunc = None
+                else:
+                    i = self.sort_fields.index(fname)
+                    keyfunc = lambda id_, i=i: self.keys[id_][i]
+                ids.sort(key=keyfunc, reverse=direction == 'DESC')
+            self._ordered[key] = ids
+        return ids
+
+
+def _popcount(bitmap):
+    try:
+        return bitmap.bit_count()
+    except AttributeError:
+        # before Python 3.10
+        return bin(bitmap).count('1')
+
+
+def _bitmap_bytes(bitmap):
+    '''Bytes of bitmap, the bit of id i being in the byte i >> 3'''
+    data = '%x' % bitmap
+    data = bytearray(binascii.unhexlify('0' * (len(data) & 1) + data))
+    data.reverse()
+    return data
+
+
+def _posting_bitmap(posting):
+    if isinstance(posting, array):
+        return ids_bitmap(posting)
+    return posting
+
+
+def ids_bitmap(ids):
+    '''Return the bitmap with the bits of ids set'''
+    if not ids:
+        return 0
+    data = bytearray((max(ids) >> 3) + 1)
+    for id_ in ids:
+        data[id_ >> 3] |= 1 << (id_ & 7)
+    data.reverse()
+    return int(binascii.hexlify(bytes(data)), 16)
+
+
+def bitmap_ids(bitmap):
+    '''Return the sorted ids of the bits set in bitmap'''
+    bits = bin(bitmap)[:1:-1]
+    ids = []
+    i = bits.find('1')
+    while i != -1:
+        ids.append(i)
+        i = bits.find('1', i + 1)
+    return ids
+
+
+# postings with less ids than 1 / SPARSE_DENSITY of the largest id are
+# kept as arrays of ids, smaller than the bitmap
+SPARSE_DENSITY = 64
+
+
+class FacetIndex(object):
+    '''Template ids by value of each filter field
+
+    A bitmap is a python int with the bits of the template ids set. The
+    postings of the values are bitmaps, or sorted arrays of ids for the
+    values of few templates. Values are kept as strings, like the values
+    posted by the filter forms; many2one values are ids and many2many values
+    count once per id.
+    '''
+
+    def __init__(self, records, fieldnames):
+        self.fieldnames = tuple(fieldnames)
+        ids = []
+        postings = dict((fname, {}) for fname in fieldnames)
+        for record in records:
+            ids.append(record['id'])
+            for fname in fieldnames:
+                values = record[fname]
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                for value in values:
+                    if value is None or value is False:
+                        continue
+                    postings[fname].setdefault('%s' % value, []).append(
+                        record['id'])
+        self.universe = ids_bitmap(ids)
+        sparse = (max(ids) if ids else 0) // SPARSE_DENSITY
+        self.postings = dict((fname, {}) for fname in fieldnames)
+        self.sizes = dict((fname, {}) for fname in fieldnames)
+        for fname, values in postings.items():
+            for value, value_ids in values.items():
+                if len(value_ids) < sparse:
+                    posting = array('l', sorted(value_ids))
+                else:
+                    posting = ids_bitmap(value_ids)
+                self.postings[fname][value] = posting
+                self.sizes[fname][value] = len(value_ids)
+
+    def bitmap(self, fname, values):
+        '''Return the bitmap of the templates with any of values'''
+        postings = self.postings.get(fname, {})
+        bitmap = 0
+        for value in values:
+            bitmap |= _posting_bitmap(postings.get('%s' % value, 0))
+        return bitmap
+
+    def _counts(self, fname, base):
+        '''Number of templates of base by value of fname'''
+        postings = self.postings.get(fname, {})
+        if base == self.universe:
+            return dict(self.sizes.get(fname, {}))
+        data = None
+        counts = {}
+        for value, posting in postings.items():
+            if isinstance(posting, array):
+                if data is None:
+                    data = _bitmap_bytes(base)
+                count = 0
+                for id_ in posting:
+                    if (id_ >> 3 < len(data)
+                            and data[id_ >> 3] >> (id_ & 7) & 1):
+                        count += 1
+            else:
+                count = _popcount(base & posting)
+            if count:
+                counts[value] = count
+        return counts
+
+    def search(self, filters, facets, universe=None):
+        '''Templates matching filters and their counts by facet value
+
+        filters maps field names to the selected values. Return the bitmap of
+        the matching templates and, for each field of facets, the number of
+        templates per value when the other filters are applied.
+        '''
+        if universe is None:
+            universe = self.universe
+        selected = dict((fname, self.bitmap(fname, values))
+            for fname, values in filters.items() if values)
+
+        matching = universe
+        for bitmap in selected.values():
+            matching &= bitmap
+
+        counts = {}
+        for fname in facets:
+            base = universe
+            for other, bitmap in selected.items():
+                if other != fname:
+                    base &= bitmap
+            counts[fname] = self._counts(fname, base)
+        return matching, counts
+
+
+def normalize_keyword(keyword):
+    return ' '.join(keyword.lower().split())
+
+
+class KeywordIndex(object):
+    '''Template ids by meta keyword token
+
+    Meta keywords are comma separated. Each keyword and each of its words
+    is a token, so lookups match whole tokens only.
+    '''
+
+    def __init__(self, records, fieldname):
+        tokens = {}
+        for record in records:
+            for keyword in (record[fieldname] or '').split(','):
+                keyword = normalize_keyword(keyword)
+                if not keyword:
+                    continue
+                for token in set([keyword] + keyword.split()):
+                    tokens.setdefault(token, set()).add(record['id'])
+        self.tokens = dict((token, sorted(ids))
+            for token, ids in tokens.items())
+
+    def lookup(self, keyword):
+        '''Return the ids of the templates with keyword or None'''
+        return self.tokens.get(normalize_keyword(keyword))
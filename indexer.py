@@ -0,0 +1,251 @@
+'''Catalog Whoosh indexer
+
+Builds and updates the catalog index read by the search views, one index
+per language under get_catalog_schema_dir. Each run only indexes the
+templates written since the previous run of the language, unless a full
+rebuild is requested, and each language is indexed in its own process.
+Runs read again the last TRYTON_CATALOG_SYNC_OVERLAP seconds, as
+write_date is the start of the writing transaction; documents are
+replaced, so templates indexed twice are harmless. Searchers keep reading
+the previous generation until the commit.
+'''
+from flask import current_app, g
+from app_extensions import tryton
+from trytond import backend
+from trytond.transaction import Transaction
+from whoosh import index, writing
+from .catalog import get_catalog_schema_dir, published_templates_domain, \
+    database_now, get_catalog_sync_overlap
+from .search_index import catalog_schema
+import copy
+import datetime
+import json
+import multiprocessing
+import os
+
+STAMP_FILE = 'catalog_indexer.json'
+STAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# connection pools inherited from the parent, kept so they are not closed
+_INHERITED_DATABASES = []
+
+
+def get_index_chunk_size():
+    return current_app.config.get('TRYTON_CATALOG_INDEX_CHUNK_SIZE', 500)
+
+
+def get_index_content_fields():
+    '''Template fields indexed as content besides the codes'''
+    return current_app.config.get('TRYTON_CATALOG_INDEX_CONTENT_FIELDS',
+        ['esale_shortdescription', 'esale_description', 'esale_metakeyword'])
+
+
+def get_index_writer_procs():
+    return current_app.config.get('TRYTON_CATALOG_INDEX_WRITER_PROCS', 1)
+
+
+def read_stamp(schema_dir):
+    try:
+        with open(os.path.join(schema_dir, STAMP_FILE)) as f:
+            return datetime.datetime.strptime(json.load(f)['since'],
+                STAMP_FORMAT)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def write_stamp(schema_dir, since):
+    with open(os.path.join(schema_dir, STAMP_FILE), 'w') as f:
+        json.dump({'since': since.strftime(STAMP_FORMAT)}, f)
+
+
+def template_document(template):
+    '''Index document of a product template'''
+    codes = [p.code for p in template.products if p.code]
+    code = getattr(template, 'code', None)
+    content = [getattr(template, fname, None)
+        for fname in get_index_content_fields()] + [code] + codes
+    content = ' '.join(c for c in content if c)
+    return {
+        'id': template.id,
+        'title': template.name,
+        'title_ngram': template.name,
+        'content': content,
+        'content_ngram': content,
+        'code': code,
+        'slug': template.esale_slug,
+        'name': (template.name or '').lower(),
+        'create_date': template.create_date,
+        'write_date': template.write_date or template.create_date,
+        }
+
+
+@tryton.transaction()
+def _changed_templates(since):
+    '''Ids of the templates to index and to delete, the number of published
+    templates and the time of the read
+
+    All the published templates without since, else the templates written
+    or created since then or whose variants were, unpublished ones being
+    deleted.
+    '''
+    Template = tryton.pool.get('product.template')
+    Product = tryton.pool.get('product.product')
+
+    now = database_now()
+    if since is None:
+        ids = [t.id for t in Template.search(published_templates_domain(),
+                order=[('id', 'ASC')])]
+        return ids, [], len(ids), now
+
+    changed_domain = ['OR',
+        ('write_date', '>=', since),
+        ('create_date', '>=', since),
+        ]
+    with Transaction().set_context(active_test=False):
+        changed = set(t.id for t in Template.search(changed_domain))
+        # variant codes are indexed with their template
+        changed.update(p.template.id for p in Product.search(changed_domain))
+    changed = sorted(changed)
+    published = set()
+    for i in range(0, len(changed), get_index_chunk_size()):
+        published.update(t.id for t in Template.search(
+                published_templates_domain() + [
+                    ('id', 'in', changed[i:i + get_index_chunk_size()]),
+                    ]))
+    count = Template.search(published_templates_domain(), count=True)
+    return ([i for i in changed if i in published],
+        [i for i in changed if i not in published], count, now)
+
+
+@tryton.transaction()
+def _unpublished_templates(ids):
+    '''Ids of ids which are not published templates, deleted ones included'''
+    Template = tryton.pool.get('product.template')
+
+    published = set()
+    size = get_index_chunk_size()
+    for i in range(0, len(ids), size):
+        published.update(t.id for t in Template.search(
+                published_templates_domain() + [
+                    ('id', 'in', ids[i:i + size]),
+                    ]))
+    return [i for i in ids if i not in published]
+
+
+def index_ids(ix):
+    '''Ids of the templates in the index'''
+    with ix.searcher() as searcher:
+        return [fields['id'] for fields in searcher.all_stored_fields()]
+
+
+@tryton.transaction()
+def _template_documents(ids):
+    Template = tryton.pool.get('product.template')
+
+    with Transaction().set_context(language=g.language):
+        return [template_document(t) for t in Template.browse(ids)]
+
+
+def _write_index(ix, ids, deleted, clear=False):
+    '''Replace the documents of ids and delete the ones of deleted
+
+    With clear, the documents of ids replace the whole index at once.
+    '''
+    procs = get_index_writer_procs()
+    writerargs = {}
+    if procs > 1:
+        writerargs = {'procs': procs, 'multisegment': True}
+    writer = writing.AsyncWriter(ix, writerargs=writerargs)
+    try:
+        if not clear:
+            for id_ in ids + deleted:
+                writer.delete_by_term('id', id_)
+        size = get_index_chunk_size()
+        for i in range(0, len(ids), size):
+            for document in _template_documents(ids[i:i + size]):
+                writer.add_document(**document)
+    except Exception:
+        writer.cancel()
+        raise
+    if clear:
+        writer.commit(mergetype=writing.CLEAR)
+    else:
+        writer.commit()
+    if writer.is_alive():
+        # the index was locked, the writer commits from its thread
+        writer.join()
+
+
+def index_language(app, lang, full=False):
+    '''Index the published templates of the shop in the lang index
+
+    Return the number of indexed and deleted templates.
+    '''
+    with app.test_request_context('/%s/' % lang):
+        g.language = lang
+        schema_dir = get_catalog_schema_dir(lang)
+        if not schema_dir:
+            raise ValueError('WHOOSH_CATALOG_DIR is not configured')
+
+        if index.exists_in(schema_dir):
+            ix = index.open_dir(schema_dir)
+        else:
+            if not os.path.isdir(schema_dir):
+                os.makedirs(schema_dir)
+            ix = index.create_in(schema_dir, catalog_schema())
+            full = True
+
+        since = None if full else read_stamp(schema_dir)
+        ids, deleted, published, now = _changed_templates(since)
+        _write_index(ix, ids, deleted, clear=since is None)
+        if since is not None and ix.doc_count() > published:
+            # deleted templates are not found by the search of the changes,
+            # the whole index is only checked when it has extra documents
+            stale = _unpublished_templates(index_ids(ix))
+            if stale:
+                _write_index(ix, [], stale)
+                deleted += stale
+        write_stamp(schema_dir,
+            now - datetime.timedelta(seconds=get_catalog_sync_overlap()))
+        return len(ids), len(deleted)
+
+
+def _forget_parent_tryton():
+    '''Start the Tryton connection pools and transactions of a forked
+    process empty
+
+    The pooled connections of the parent share their sockets with it, so
+    they are neither used nor closed (the process ends with os._exit).
+    '''
+    try:
+        Database = backend.Database
+    except AttributeError:
+        Database = backend.get('Database')
+    databases = Database._databases
+    _INHERITED_DATABASES.append(databases)
+    fresh = copy.copy(databases)
+    fresh.clear()
+    Database._databases = fresh
+    Transaction._local = type(Transaction._local)()
+
+
+def _index_process(app, lang, full):
+    _forget_parent_tryton()
+    index_language(app, lang, full)
+
+
+def index_catalog(app, langs, full=False):
+    '''Index each of langs in its own forked process
+
+    The processes are forked, as the Flask app is not picklable, and each
+    opens its own database connections.
+    '''
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_index_process,
+            args=(app, lang, full))
+        for lang in langs]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return dict((lang, process.exitcode)
+        for lang, process in zip(langs, processes))
@@ -0,0 +1,252 @@
+'''Whoosh catalog index helpers
+
+Opened indexes and searchers are kept per process and per index directory
+(one directory per language), so requests reuse them instead of reopening
+the segment files. Searchers are refreshed when the index generation on disk
+changes.
+'''
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from whoosh import fields, index, sorting
+
+_LOCK = Lock()
+_INDEXES = {}
+_SEARCHERS = {}
+_PREFIX_INDEXES = {}
+# held while a prefix index is built, apart from _LOCK of the searchers
+_PREFIX_LOCK = Lock()
+
+
+def get_index(schema_dir):
+    '''Return the opened index for schema_dir or None when there is no index'''
+    ix = _INDEXES.get(schema_dir)
+    if ix is not None:
+        return ix
+    with _LOCK:
+        ix = _INDEXES.get(schema_dir)
+        if ix is None:
+            if not index.exists_in(schema_dir):
+                return None
+            ix = index.open_dir(schema_dir)
+            _INDEXES[schema_dir] = ix
+    return ix
+
+
+def index_generation(schema_dir):
+    '''Return the latest generation of the index in schema_dir on disk'''
+    ix = get_index(schema_dir)
+    if ix is None:
+        return None
+    return ix.latest_generation()
+
+
+def _acquire_searcher(schema_dir):
+    ix = get_index(schema_dir)
+    if ix is None:
+        return None
+    with _LOCK:
+        idle = _SEARCHERS.setdefault(schema_dir, [])
+        searcher = idle.pop() if idle else None
+    if searcher is None:
+        return ix.searcher()
+    if not searcher.up_to_date():
+        # refresh() returns a new searcher over the latest generation and
+        # releases the readers of the segments no longer in use
+        searcher = searcher.refresh()
+    return searcher
+
+
+def _release_searcher(schema_dir, searcher, pool_size):
+    with _LOCK:
+        idle = _SEARCHERS.setdefault(schema_dir, [])
+        if len(idle) < pool_size:
+            idle.append(searcher)
+            return
+    searcher.close()
+
+
+@contextmanager
+def pooled_searcher(schema_dir, pool_size=4):
+    '''Context manager that yields a searcher over the latest index generation
+
+    The searcher is borrowed from the pool of schema_dir and given back on
+    exit. Yields None when there is no index in schema_dir.
+    '''
+    searcher = _acquire_searcher(schema_dir)
+    if searcher is None:
+        yield None
+        return
+    try:
+        yield searcher
+    except Exception:
+        searcher.close()
+        raise
+    else:
+        _release_searcher(schema_dir, searcher, pool_size)
+
+
+def close_searchers(schema_dir=None):
+    '''Close pooled searchers and forget opened indexes'''
+    with _LOCK:
+        if schema_dir:
+            dirs = [schema_dir]
+        else:
+            dirs = list(set(_SEARCHERS) | set(_INDEXES))
+        for dirname in dirs:
+            for searcher in _SEARCHERS.pop(dirname, []):
+                searcher.close()
+            _INDEXES.pop(dirname, None)
+
+
+def normalize_query(q):
+    '''Collapse the whitespace of a user query string'''
+    return ' '.join(q.split())
+
+
+def ngram_fields(schema, fieldnames):
+    '''Return the fieldnames that are n-gram fields of schema'''
+    return [f for f in fieldnames
+        if f in schema and isinstance(schema[f], fields.NGRAM)]
+
+
+def substring_clause(word, schema, ngramfields, parsefields=None):
+    '''Return a query string matching word as a term or as a substring
+
+    Substrings are looked up in the n-gram fields when the word is long
+    enough to give n-grams. The parse fields without such an n-gram
+    companion (named <field>_ngram) are matched with a *word* wildcard,
+    which scans their term dictionary.
+    '''
+    clauses = ['%s:%s' % (fieldname, word) for fieldname in ngramfields
+        if list(schema[fieldname].process_text(word, mode='query'))]
+    if not clauses:
+        clauses = ['*' + word + '*']
+    elif parsefields:
+        covered = set(c.split(':', 1)[0] for c in clauses)
+        clauses += ['%s:*%s*' % (fieldname, word) for fieldname in parsefields
+            if fieldname + '_ngram' not in covered]
+    return '("' + word + '" OR ' + ' OR '.join(clauses) + ')'
+
+
+def sortable_columns(schema, fieldnames):
+    '''Return whether all fieldnames are sortable columns of schema'''
+    for fieldname in fieldnames:
+        if fieldname not in schema:
+            return False
+        if getattr(schema[fieldname], 'column_type', None) is None:
+            return False
+    return True
+
+
+def search_ids(searcher, query, max_limit, sortedby=None):
+    '''Search the catalog index in one scoring pass
+
+    Return the ids of the max_limit first hits, in relevance order or sorted
+    by sortedby, a sequence of (column, reverse) pairs of sortable columns.
+    '''
+    facet = None
+    if sortedby:
+        facet = sorting.MultiFacet([sorting.FieldFacet(column, reverse=reverse)
+            for column, reverse in sortedby])
+    results = searcher.search(query, limit=max_limit, sortedby=facet)
+    return [hit.get('id') for hit in results]
+
+
+class PrefixIndex(object):
+    '''Sorted array of lowercased keys answering prefix lookups with ids'''
+
+    def __init__(self, entries, names):
+        entries = sorted(set(entries))
+        self.keys = [key for key, _ in entries]
+        self.ids = [id_ for _, id_ in entries]
+        self.names = names
+
+    def lookup(self, prefix, limit):
+        '''Return up to limit distinct ids with a key starting with prefix'''
+        prefix = prefix.lower()
+        ids = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(ids) < limit:
+            if not self.keys[i].startswith(prefix):
+                break
+            if self.ids[i] not in ids:
+                ids.append(self.ids[i])
+            i += 1
+        return ids
+
+    @classmethod
+    def from_index(cls, ix, fieldnames):
+        '''Build from the stored fieldnames of each document of ix
+
+        The whole value and each of its words are keys. The value of the
+        first field is kept as the document name.
+        '''
+        entries = []
+        names = {}
+        with ix.searcher() as searcher:
+            for stored in searcher.all_stored_fields():
+                id_ = stored.get('id')
+                if id_ is None:
+                    continue
+                names[id_] = {
+                    'name': stored.get(fieldnames[0]),
+                    'slug': stored.get('slug'),
+                    }
+                for fieldname in fieldnames:
+                    value = stored.get(fieldname)
+                    if not value:
+                        continue
+                    value = value.lower()
+                    entries.append((value, id_))
+                    for word in value.split():
+                        entries.append((word, id_))
+        return cls(entries, names)
+
+
+def get_prefix_index(schema_dir, fieldnames):
+    '''Return the PrefixIndex of schema_dir, rebuilt on a new generation
+
+    While a thread builds the new one, the others keep using the previous
+    generation when there is one.
+    '''
+    ix = get_index(schema_dir)
+    if ix is None:
+        return None
+    generation = ix.latest_generation()
+    cached = _PREFIX_INDEXES.get(schema_dir)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    if not _PREFIX_LOCK.acquire(cached is None):
+        return cached[1]
+    try:
+        cached = _PREFIX_INDEXES.get(schema_dir)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        prefix_index = PrefixIndex.from_index(ix, fieldnames)
+        _PREFIX_INDEXES[schema_dir] = (generation, prefix_index)
+    finally:
+        _PREFIX_LOCK.release()
+    return prefix_index
+
+
+def catalog_schema():
+    '''Schema of the catalog index built by the catalog indexer
+
+    title and content are the default search fields, title_ngram and
+    content_ngram answer their substring matches, slug and code are stored
+    for the suggestions and name, create_date and write_date are sortable
+    columns.
+    '''
+    return fields.Schema(
+        id=fields.NUMERIC(int, bits=64, stored=True, unique=True),
+        title=fields.TEXT(stored=True),
+        title_ngram=fields.NGRAMWORDS(minsize=3, maxsize=5),
+        content=fields.TEXT,
+        content_ngram=fields.NGRAMWORDS(minsize=3, maxsize=5),
+        code=fields.ID(stored=True),
+        slug=fields.ID(stored=True),
+        name=fields.ID(sortable=True),
+        create_date=fields.DATETIME(sortable=True),
+        write_date=fields.DATETIME(sortable=True),
+        )
@@ -0,0 +1,137 @@
+'''Timings of the catalog request phases
+
+A request is timed when a RequestTimings is set as g.catalog_timings.
+Otherwise timed returns a shared context manager that does nothing, so
+untimed requests only pay for a lookup in g.
+'''
+from collections import OrderedDict
+from threading import Lock
+from flask import g
+import time
+
+# upper bounds in milliseconds of the histogram buckets
+TIMING_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_HISTOGRAMS = {}
+_HISTOGRAMS_LOCK = Lock()
+
+
+class _NotTimed(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+_NOT_TIMED = _NotTimed()
+
+
+class _Phase(object):
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.timings.add(self.name, time.time() - self.start)
+        return False
+
+
+def timed(name):
+    '''Context manager adding its duration to the phase name of the request'''
+    timings = g.get('catalog_timings')
+    if timings is None:
+        return _NOT_TIMED
+    return _Phase(timings, name)
+
+
+class RequestTimings(object):
+    '''Duration and number of calls of each phase of a request'''
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = OrderedDict()
+
+    def add(self, name, duration):
+        phase = self.phases.setdefault(name, [0, 0])
+        phase[0] += duration
+        phase[1] += 1
+
+    def metrics(self):
+        '''Return (name, milliseconds, calls) of the phases and the total'''
+        metrics = [(name, duration * 1000, calls)
+            for name, (duration, calls) in self.phases.items()]
+        metrics.append(('total', (time.time() - self.start) * 1000, 1))
+        return metrics
+
+    def header(self, metrics):
+        '''Server-Timing header value of metrics'''
+        values = []
+        for name, milliseconds, calls in metrics:
+            value = '%s;dur=%.2f' % (name, milliseconds)
+            if name != 'total':
+                value += ';desc="%d calls"' % calls
+            values.append(value)
+        return ', '.join(values)
+
+
+class Histogram(object):
+    '''Counts of durations by TIMING_BUCKETS'''
+
+    def __init__(self):
+        self.buckets = [0] * (len(TIMING_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0
+        self.calls = 0
+
+    def add(self, milliseconds, calls=1):
+        i = 0
+        while i < len(TIMING_BUCKETS) and milliseconds > TIMING_BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.sum += milliseconds
+        self.calls += calls
+
+    def stats(self):
+        buckets = OrderedDict(('le_%s' % bound, count)
+            for bound, count in zip(TIMING_BUCKETS, self.buckets))
+        buckets['le_inf'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'sum_ms': self.sum,
+            'calls': self.calls,
+            'buckets': buckets,
+            }
+
+
+def record_timings(endpoint, metrics, hook=None):
+    '''Add metrics of a request to the process histograms of endpoint
+
+    hook is called with the metric name, the milliseconds and the number of
+    calls of each phase, e.g. to send them to statsd.
+    '''
+    with _HISTOGRAMS_LOCK:
+        for name, milliseconds, calls in metrics:
+            histogram = _HISTOGRAMS.get((endpoint, name))
+            if histogram is None:
+                histogram = _HISTOGRAMS[(endpoint, name)] = Histogram()
+            histogram.add(milliseconds, calls)
+    if hook is not None:
+        for name, milliseconds, calls in metrics:
+            hook('%s.%s' % (endpoint, name), milliseconds, calls)
+
+
+def timings_stats():
+    '''Return the histograms of this process by endpoint and phase'''
+    stats = {}
+    with _HISTOGRAMS_LOCK:
+        for (endpoint, name), histogram in _HISTOGRAMS.items():
+            stats.setdefault(endpoint, {})[name] = histogram.stats()
+    return stats